@@ -0,0 +1,443 @@
+'''
+This file contains simple benchmarks for the code in MakeLatentHealthFile.py,
+used to check that performance changes actually speed things up and that they
+do not change the output. It can be run from a command line using:
+
+> python BenchmarkLatentHealth.py spec_name node_count health_min health_max
+
+All arguments are optional; by default, the main specification is used with a
+discretization of 120 nodes spanning [-12, 28]. Temporary files are written to
+the system's temporary directory and deleted afterward.
+
+It also contains a suite of benchmark cases covering the main work of the code,
+whose results are written to a JSON file so that runs can be compared over time:
+
+> python BenchmarkLatentHealth.py --suite results_name [--baseline baseline_name] [--nodes 40,120]
+
+The cases are: startup of new Python processes that import MakeLatentHealthFile.py
+and that make a process file for TwoStudyAllTinyParams, makeTransProbArray at 40,
+120, 360, and 1000 nodes (or the node counts given with --nodes), writing and loading
+a process file at 120 nodes, and the filter at 40 nodes conditioning on Z = 1 through
+5 waves of SRHS, all for the main specification. Each case is run several times (once
+for the slowest filter cases) and its fastest time is kept. The startup cases alone
+can be run with:
+
+> python BenchmarkLatentHealth.py --startup
+
+which also lists any slow-to-import modules (such as scipy.stats) that are loaded
+just by importing MakeLatentHealthFile.py; there should be none.
+
+The cases are deterministic and use no random numbers. If a baseline results file
+is named, each case is compared to it and any case that is more than 10% slower is
+reported as a regression.
+'''
+from struct import pack
+from time import time
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import numpy as np
+from MakeLatentHealthFile import LatentHealthModel, mystr, __version__
+from LoadLatentHealthProcess import loadLatentHealthProcess
+
+# Specification and discretization used by the benchmark suite
+suite_spec = 'TwoStudyAllOver23HeteroParams'
+suite_health_min = -12.
+suite_health_max = 28.
+suite_trans_nodes = [40, 120, 360, 1000]
+suite_io_nodes = 120
+suite_filter_nodes = 40
+suite_filter_waves = [1, 2, 3, 4, 5]
+
+# Modules that take long to import, which should not be loaded just by importing
+# MakeLatentHealthFile.py
+startup_heavy_modules = ['scipy.special', 'scipy.stats', 'scipy.sparse', 'pandas', 'pyarrow']
+
+# Relative slowdown from the baseline that counts as a regression
+regression_tolerance = 0.10
+
+
+def writeProcessLoop(MyModel, output_name):
+    '''
+    Write a discretized latent health process to disk one value at a time, as
+    was originally done in MakeLatentHealthFile.py. This is kept only as a point
+    of comparison for LatentHealthModel.write_process.
+
+    Parameters
+    ----------
+    MyModel : LatentHealthModel
+        A latent health model whose arrays have already been built.
+    output_name : str
+        The name of the file to which to write the latent health process.
+
+    Returns
+    -------
+    None
+    '''
+    with open(output_name, 'wb') as f:
+        f.write(int(MyModel.x_count_cond).to_bytes(1, 'big'))
+        f.write(int(MyModel.age_count_A).to_bytes(1, 'big'))
+        f.write(int(MyModel.report_count).to_bytes(1, 'big'))
+        f.write((MyModel.report_type_count).to_bytes(1, 'big'))
+        for h in range(MyModel.x_count_cond):
+            f.write(pack('>d', MyModel.x_grid[h]))
+        for s in range(2):
+            for j in range(MyModel.age_count_A):
+                for h in range(MyModel.x_count_cond):
+                    f.write(pack('>d', MyModel.LivPrbArray[s,j,h]))
+        for s in range(2):
+            for j in range(MyModel.age_count_A):
+                for i in range(MyModel.x_count_cond):
+                    for h in range(MyModel.x_count_cond):
+                        f.write(pack('>d', MyModel.TransPrbArray[s,j,i,h]))
+        for k in range(MyModel.report_type_count):
+            for x in range(MyModel.report_count):
+                for h in range(MyModel.x_count_cond):
+                    f.write(pack('>d', MyModel.ReportPrbArray[k,x,h]))
+        for s in range(2):
+            for j in range(MyModel.age_count_A):
+                for h in range(MyModel.x_count_cond):
+                    f.write(pack('>d', MyModel.HealthInitDstn[s,j,h]))
+        f.close()
+
+
+def benchmarkProcessWriter(MyModel):
+    '''
+    Time the vectorized process file writer against the original loop writer,
+    and check that they produce exactly the same bytes. The vectorized writer
+    uses the original (version 1) file format, as the loop writer does.
+
+    Parameters
+    ----------
+    MyModel : LatentHealthModel
+        A latent health model whose arrays have already been built.
+
+    Returns
+    -------
+    results : dict
+        Dictionary with run times of each writer (in seconds), their ratio, and
+        whether the two files are identical.
+    '''
+    temp_dir = tempfile.mkdtemp()
+    loop_name = os.path.join(temp_dir, 'loop.dat')
+    fast_name = os.path.join(temp_dir, 'fast.dat')
+
+    t0 = time()
+    writeProcessLoop(MyModel, loop_name)
+    t1 = time()
+    MyModel.write_process(fast_name, file_version=1)
+    t2 = time()
+
+    with open(loop_name, 'rb') as f:
+        loop_bytes = f.read()
+    with open(fast_name, 'rb') as f:
+        fast_bytes = f.read()
+    os.remove(loop_name)
+    os.remove(fast_name)
+    os.rmdir(temp_dir)
+
+    results = {
+        'loop_time' : t1 - t0,
+        'fast_time' : t2 - t1,
+        'speedup' : (t1 - t0)/(t2 - t1),
+        'identical' : loop_bytes == fast_bytes,
+        }
+    return results
+
+
+def timeCase(func, repeats):
+    '''
+    Run a function several times, returning the run time of each.
+
+    Parameters
+    ----------
+    func : function
+        Function with no arguments to be timed.
+    repeats : int
+        Number of times to run the function.
+
+    Returns
+    -------
+    times : [float]
+        Run time of each call to func, in seconds.
+    '''
+    times = []
+    for n in range(repeats):
+        t0 = time()
+        func()
+        t1 = time()
+        times.append(t1 - t0)
+    return times
+
+
+def benchmarkTransProbArray(node_count, repeats=3):
+    '''
+    Time LatentHealthModel.makeTransProbArray for the main specification.
+
+    Parameters
+    ----------
+    node_count : int
+        Number of nodes in the latent health discretization.
+    repeats : int
+        Number of times to build the array.
+
+    Returns
+    -------
+    result : dict
+        Dictionary with the fastest and all run times (in seconds).
+    '''
+    MyModel = LatentHealthModel(suite_spec, node_count, suite_health_min, suite_health_max)
+    param_dict = MyModel.makeParameterDict(MyModel.current_param_vec)
+    arg_names = list(inspect.signature(MyModel.makeTransProbArray).parameters)
+    trans_args = {name : param_dict[name] for name in arg_names}
+    times = timeCase(lambda : MyModel.makeTransProbArray(**trans_args), repeats)
+    result = {'seconds' : min(times), 'times' : times}
+    return result
+
+
+def benchmarkProcessIO(repeats=5):
+    '''
+    Time writing a process file with LatentHealthModel.write_process and loading
+    it with loadLatentHealthProcess, both by reading it into memory and by memory
+    mapping it. Each load also reads every value, so memory-mapped pages are used.
+
+    Parameters
+    ----------
+    repeats : int
+        Number of times to write and load the file.
+
+    Returns
+    -------
+    results : dict
+        Dictionary of results for the write, read, and memmap cases, each with the
+        fastest and all run times (in seconds) and throughput in MB per second.
+    '''
+    MyModel = LatentHealthModel(suite_spec, suite_io_nodes, suite_health_min, suite_health_max)
+    MyModel.build()
+    temp_dir = tempfile.mkdtemp()
+    file_name = os.path.join(temp_dir, 'process.dat')
+
+    def loadAll(use_memmap):
+        arrays = loadLatentHealthProcess(file_name, use_memmap=use_memmap)
+        return [np.sum(array) for array in arrays]
+
+    cases = {
+        'write' : lambda : MyModel.write_process(file_name),
+        'read' : lambda : loadAll(False),
+        'memmap' : lambda : loadAll(True),
+        }
+    results = {}
+    for name, func in cases.items():
+        times = timeCase(func, repeats)
+        megabytes = os.path.getsize(file_name)/2.**20
+        results[name] = {'seconds' : min(times), 'times' : times, 'MB_per_second' : megabytes/min(times)}
+    os.remove(file_name)
+    os.rmdir(temp_dir)
+    return results
+
+
+def benchmarkFilter(Z_to_cond, repeats=3):
+    '''
+    Time LatentHealthModel.filter for the main specification, writing a text file.
+
+    Parameters
+    ----------
+    Z_to_cond : int
+        Number of survey waves on which to condition latent health.
+    repeats : int
+        Number of times to run the filter.
+
+    Returns
+    -------
+    result : dict
+        Dictionary with the fastest and all run times (in seconds).
+    '''
+    MyModel = LatentHealthModel(suite_spec, suite_filter_nodes, suite_health_min, suite_health_max)
+    MyModel.build()
+    temp_dir = tempfile.mkdtemp()
+    file_name = os.path.join(temp_dir, 'filter.txt')
+    times = timeCase(lambda : MyModel.filter(file_name, Z_to_cond), repeats)
+    os.remove(file_name)
+    os.rmdir(temp_dir)
+    result = {'seconds' : min(times), 'times' : times}
+    return result
+
+
+def benchmarkStartup(repeats=5):
+    '''
+    Time cold invocations of MakeLatentHealthFile.py in new Python processes, as in
+    a job array: importing the module, and making a process file for the 15 node
+    TwoStudyAllTinyParams specification from the command line. Also check which
+    heavy modules the import loads.
+
+    Parameters
+    ----------
+    repeats : int
+        Number of times to run each case.
+
+    Returns
+    -------
+    results : dict
+        Dictionary of results for the import and tiny process cases, each with the
+        fastest and all run times (in seconds), and a list of the modules in
+        startup_heavy_modules that were loaded by the import alone.
+    '''
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    temp_dir = tempfile.mkdtemp()
+    file_name = os.path.join(temp_dir, 'tiny.dat')
+    commands = {
+        'import' : [sys.executable, '-c', 'import MakeLatentHealthFile'],
+        'tiny_process' : [sys.executable, os.path.join(code_dir, 'MakeLatentHealthFile.py'), 'process',
+                          'TwoStudyAllTinyParams', file_name, '15', '-6', '22'],
+        }
+    results = {}
+    for name, command in commands.items():
+        run = lambda : subprocess.run(command, cwd=code_dir, check=True, stdout=subprocess.DEVNULL)
+        run() # Make sure that compiled files exist before timing
+        times = timeCase(run, repeats)
+        results[name] = {'seconds' : min(times), 'times' : times}
+    os.remove(file_name)
+    os.rmdir(temp_dir)
+
+    check = 'import sys, MakeLatentHealthFile; print(\' \'.join(m for m in ' + repr(startup_heavy_modules) + ' if m in sys.modules))'
+    loaded = subprocess.run([sys.executable, '-c', check], cwd=code_dir, check=True, capture_output=True, text=True)
+    results['import']['heavy_modules'] = loaded.stdout.split()
+    return results
+
+
+def runSuite(trans_nodes=suite_trans_nodes):
+    '''
+    Run every case in the benchmark suite.
+
+    Parameters
+    ----------
+    trans_nodes : [int]
+        Node counts at which to time makeTransProbArray.
+
+    Returns
+    -------
+    results : dict
+        Dictionary with a description of the run ('meta') and the results of each
+        case by name ('cases').
+    '''
+    cases = {}
+    for name, result in benchmarkStartup().items():
+        cases['startup_' + name] = result
+    print('Timed startup of new processes.')
+    for node_count in trans_nodes:
+        cases['trans_' + str(node_count)] = benchmarkTransProbArray(node_count)
+        print('Timed makeTransProbArray with ' + str(node_count) + ' nodes.')
+    for name, result in benchmarkProcessIO().items():
+        cases['process_' + name] = result
+    print('Timed process file writing and loading.')
+    for Z_to_cond in suite_filter_waves:
+        repeats = 3 if Z_to_cond < 4 else 1 # Longer cases vary less between runs
+        cases['filter_Z' + str(Z_to_cond)] = benchmarkFilter(Z_to_cond, repeats)
+        print('Timed filter conditioning on ' + str(Z_to_cond) + ' waves.')
+
+    meta = {
+        'spec' : suite_spec,
+        'version' : __version__,
+        'python' : platform.python_version(),
+        'numpy' : np.__version__,
+        'platform' : platform.platform(),
+        'date' : time(),
+        }
+    results = {'meta' : meta, 'cases' : cases}
+    return results
+
+
+def compareResults(results, baseline):
+    '''
+    Compare the fastest time of each benchmark case to a baseline run, printing
+    a line for each case that appears in both.
+
+    Parameters
+    ----------
+    results : dict
+        Results of the benchmark suite, as made by runSuite.
+    baseline : dict
+        Results of an earlier run of the benchmark suite.
+
+    Returns
+    -------
+    regressions : [str]
+        Names of cases that are more than regression_tolerance slower than baseline.
+    '''
+    regressions = []
+    for name, result in results['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        ratio = result['seconds']/baseline['cases'][name]['seconds']
+        flag = ''
+        if ratio > 1. + regression_tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(name.ljust(16) + mystr(baseline['cases'][name]['seconds']).rjust(10) + mystr(result['seconds']).rjust(10) + '  x' + mystr(ratio) + flag)
+    return regressions
+
+
+def main(my_args):
+    '''
+    Run the benchmarks from the command line; see documentation at the top of this file.
+
+    Parameters
+    ----------
+    my_args : [str]
+        List of command line arguments, as in sys.argv.
+
+    Returns
+    -------
+    None
+    '''
+    # Only time startup if the --startup argument is given
+    if '--startup' in my_args:
+        results = benchmarkStartup()
+        print('Importing MakeLatentHealthFile.py took ' + mystr(results['import']['seconds']) + ' seconds.')
+        print('Making a process file for TwoStudyAllTinyParams took ' + mystr(results['tiny_process']['seconds']) + ' seconds.')
+        heavy_modules = results['import']['heavy_modules']
+        if len(heavy_modules) > 0:
+            print('Importing MakeLatentHealthFile.py also imported ' + ', '.join(heavy_modules) + '.')
+        return
+
+    # Run the benchmark suite if the --suite argument is given
+    if '--suite' in my_args:
+        results_name = my_args[my_args.index('--suite')+1]
+        trans_nodes = suite_trans_nodes
+        if '--nodes' in my_args:
+            trans_nodes = [int(n) for n in my_args[my_args.index('--nodes')+1].split(',')]
+        results = runSuite(trans_nodes)
+        with open(results_name, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Wrote benchmark results to ' + results_name + '.')
+        if '--baseline' in my_args:
+            with open(my_args[my_args.index('--baseline')+1]) as f:
+                baseline = json.load(f)
+            print('case'.ljust(16) + 'baseline'.rjust(10) + 'current'.rjust(10))
+            regressions = compareResults(results, baseline)
+            if len(regressions) > 0:
+                print(str(len(regressions)) + ' cases are more than ' + str(int(100*regression_tolerance)) + '% slower than the baseline.')
+                sys.exit(1)
+        return
+
+    spec_name = my_args[1] if len(my_args) > 1 else 'TwoStudyAllOver23HeteroParams'
+    node_count = int(my_args[2]) if len(my_args) > 2 else 120
+    health_min = float(my_args[3]) if len(my_args) > 3 else -12.
+    health_max = float(my_args[4]) if len(my_args) > 4 else 28.
+
+    MyModel = LatentHealthModel(spec_name, node_count, health_min, health_max)
+    MyModel.build()
+
+    results = benchmarkProcessWriter(MyModel)
+    print('Process writer with ' + str(node_count) + ' nodes for ' + spec_name + ':')
+    print('Loop writer took ' + mystr(results['loop_time']) + ' seconds.')
+    print('Vectorized writer took ' + mystr(results['fast_time']) + ' seconds.')
+    print('Speedup factor is ' + mystr(results['speedup']) + ', output files are ' + ('identical.' if results['identical'] else 'DIFFERENT!'))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,148 @@
+'''
+This file contains a content-addressed disk cache for the arrays that define a
+discretized latent health process: LivPrbArray, TransPrbArray, ReportPrbArray,
+and HealthInitDstn. Building these arrays for a fine grid takes much longer than
+reading them, so a LatentHealthModel that is given a cache will first look for
+arrays that were already built from the same parameters and grid.
+
+Each entry in the cache is a directory named by a hash of everything that the
+arrays depend on (see LatentHealthModel.makeCacheKey), holding one .npy file per
+array in native byte order. Entries are loaded as read-only memory-mapped arrays.
+When the total size of the cache goes over its limit, the least recently used
+entries are deleted.
+
+The cache directory can be named directly; otherwise it is given by the environment
+variable LATENT_HEALTH_CACHE, or ~/.cache/LatentHealthLite if that is not set.
+'''
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# Names of the arrays stored in each cache entry
+cache_array_names = ['LivPrbArray', 'TransPrbArray', 'ReportPrbArray', 'HealthInitDstn']
+
+# Default maximum total size of the cache, in bytes
+default_cache_bytes = 4*2**30
+
+
+class ProbArrayCache(object):
+    '''
+    A disk cache of latent health probability arrays, with a size limit and
+    least recently used eviction.
+
+    Parameters
+    ----------
+    cache_dir : str or None
+        Directory in which to keep the cache; it is made if it does not exist.
+        If None, the default directory described above is used.
+    max_bytes : int
+        Maximum total size of all entries in the cache, in bytes.
+    '''
+    def __init__(self, cache_dir=None, max_bytes=default_cache_bytes):
+        if cache_dir is None:
+            cache_dir = os.environ.get('LATENT_HEALTH_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'LatentHealthLite'))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    def load(self, key):
+        '''
+        Load the arrays stored under a key, if there are any, and mark that entry
+        as recently used.
+
+        Parameters
+        ----------
+        key : str
+            Hash identifying the entry.
+
+        Returns
+        -------
+        arrays : [np.array] or None
+            List of memory-mapped LivPrbArray, TransPrbArray, ReportPrbArray, and
+            HealthInitDstn, or None if the key is not in the cache.
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            arrays = [np.load(os.path.join(entry_dir, name + '.npy'), mmap_mode='r') for name in cache_array_names]
+        except (OSError, ValueError):
+            return None
+        os.utime(entry_dir)
+        return arrays
+
+
+    def save(self, key, arrays):
+        '''
+        Store arrays under a key, then delete the least recently used entries
+        if the cache is over its size limit. The entry is written to a temporary
+        directory and then renamed, so other processes never see a partial entry.
+
+        Parameters
+        ----------
+        key : str
+            Hash identifying the entry.
+        arrays : [np.array]
+            List of LivPrbArray, TransPrbArray, ReportPrbArray, and HealthInitDstn.
+
+        Returns
+        -------
+        None
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        temp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp')
+        try:
+            for name, array in zip(cache_array_names, arrays):
+                np.save(os.path.join(temp_dir, name + '.npy'), np.asarray(array))
+            os.replace(temp_dir, entry_dir)
+        except OSError: # Another process stored the same entry first
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        self.evict(keep=key)
+
+
+    def evict(self, keep=None):
+        '''
+        Delete the least recently used entries until the total size of the cache
+        is no more than max_bytes.
+
+        Parameters
+        ----------
+        keep : str or None
+            Key of an entry that should not be deleted, even if it is the oldest.
+
+        Returns
+        -------
+        None
+        '''
+        entries = []
+        total_bytes = 0
+        for key in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+                entries.append((os.path.getmtime(entry_dir), size, key))
+            except OSError: # Entry was deleted by another process
+                continue
+            total_bytes += size
+
+        for last_used, size, key in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total_bytes -= size
+
+
+    def clear(self):
+        '''
+        Delete every entry in the cache.
+
+        Returns
+        -------
+        None
+        '''
+        for key in os.listdir(self.cache_dir):
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
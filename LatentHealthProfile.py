@@ -0,0 +1,215 @@
+'''
+This file contains a simple profiler for the stages of work in MakeLatentHealthFile.py,
+so that a slow job can be understood without attaching an external profiler. Each
+LatentHealthModel has a StageProfiler, which is disabled by default and then does
+nothing. When it is enabled, it records for each named stage of work:
+
+calls            : The number of times the stage was run.
+seconds          : The total wall clock time spent in the stage.
+max_rss_bytes    : The peak resident memory of the process when the stage last ended.
+
+If memory tracing is also enabled (with Python's tracemalloc module, which slows
+down the code noticeably), it records for each stage:
+
+alloc_bytes      : The net memory allocated during the stage, summed over calls.
+peak_alloc_bytes : The largest amount of memory in use during the stage, above
+                   the amount in use when the stage began.
+
+It also keeps counters of units of work, such as the number of SRHS sequences
+filtered. A report with all of these can be written to a JSON file or logged.
+'''
+from contextlib import contextmanager
+from time import time
+import json
+import logging
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+logger = logging.getLogger('LatentHealth')
+
+
+def getMaxRSS():
+    '''
+    Get the peak resident memory of this process so far.
+
+    Returns
+    -------
+    max_rss : int or None
+        Peak resident memory in bytes, or None if it is not available.
+    '''
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else 1024*max_rss # Linux reports kilobytes
+
+
+class StageProfiler(object):
+    '''
+    Timers, memory measurements, and counters for named stages of work.
+
+    Parameters
+    ----------
+    enabled : bool
+        Indicator for whether anything should be recorded.
+    trace_memory : bool
+        Indicator for whether memory allocations should be traced with tracemalloc.
+    '''
+    def __init__(self, enabled=False, trace_memory=False):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.stages = {}
+        self.counters = {}
+        self.peak_stack = []
+        self.start_time = time()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Context manager that records the time and memory used by the code it contains
+        as a run of the named stage. Stages can be nested.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        '''
+        if not self.enabled:
+            yield
+            return
+        if self.trace_memory:
+            start_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            if len(self.peak_stack) > 0: # Keep the enclosing stage's peak before resetting it
+                self.peak_stack[-1] = max(self.peak_stack[-1], peak_bytes)
+            tracemalloc.reset_peak()
+            self.peak_stack.append(start_bytes)
+        t0 = time()
+        try:
+            yield
+        finally:
+            t1 = time()
+            record = self.stages.setdefault(name, {'calls' : 0, 'seconds' : 0.})
+            record['calls'] += 1
+            record['seconds'] += t1 - t0
+            record['max_rss_bytes'] = getMaxRSS()
+            if self.trace_memory:
+                # The peak since the last reset, or the peak of a nested stage
+                end_bytes, peak_bytes = tracemalloc.get_traced_memory()
+                peak_bytes = max(peak_bytes, self.peak_stack.pop())
+                record['alloc_bytes'] = record.get('alloc_bytes', 0) + end_bytes - start_bytes
+                record['peak_alloc_bytes'] = max(record.get('peak_alloc_bytes', 0), peak_bytes - start_bytes)
+                if len(self.peak_stack) > 0: # Pass this peak on to the enclosing stage
+                    self.peak_stack[-1] = max(self.peak_stack[-1], peak_bytes)
+
+
+    def count(self, name, n=1):
+        '''
+        Add to a named counter.
+
+        Parameters
+        ----------
+        name : str
+            Name of the counter.
+        n : int
+            Amount to add.
+
+        Returns
+        -------
+        None
+        '''
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+
+    def merge(self, report):
+        '''
+        Add the stages and counters in a report from another profiler, such as one
+        in a worker process, to this one.
+
+        Parameters
+        ----------
+        report : dict
+            Report made by StageProfiler.report.
+
+        Returns
+        -------
+        None
+        '''
+        for name, other in report['stages'].items():
+            record = self.stages.setdefault(name, {'calls' : 0, 'seconds' : 0.})
+            for key, value in other.items():
+                if value is None:
+                    continue
+                if key in ['calls', 'seconds', 'alloc_bytes']:
+                    record[key] = record.get(key, 0) + value
+                else:
+                    record[key] = max(record.get(key) or 0, value)
+        for name, value in report['counters'].items():
+            self.count(name, value)
+
+
+    def reset(self):
+        '''
+        Clear all stages and counters.
+
+        Returns
+        -------
+        None
+        '''
+        self.stages = {}
+        self.counters = {}
+        self.start_time = time()
+
+
+    def report(self):
+        '''
+        Make a report of everything recorded so far.
+
+        Returns
+        -------
+        report : dict
+            Dictionary with the time since the profiler was made or reset ('seconds'),
+            the peak resident memory of the process ('max_rss_bytes'), and the records
+            of each stage ('stages') and counter ('counters') by name.
+        '''
+        report = {
+            'seconds' : time() - self.start_time,
+            'max_rss_bytes' : getMaxRSS(),
+            'stages' : self.stages,
+            'counters' : self.counters,
+            }
+        return report
+
+
+    def write(self, output_name=None):
+        '''
+        Write the report to a JSON file, or log one line for each stage and counter.
+
+        Parameters
+        ----------
+        output_name : str or None
+            Name of the JSON file to write; if None, the report is logged at the
+            INFO level to the 'LatentHealth' logger instead.
+
+        Returns
+        -------
+        None
+        '''
+        report = self.report()
+        if output_name is not None:
+            with open(output_name, 'w') as f:
+                json.dump(report, f, indent=2)
+                f.close()
+            return
+        for name, record in report['stages'].items():
+            logger.info('stage ' + name + ' ' + json.dumps(record))
+        for name, value in report['counters'].items():
+            logger.info('counter ' + name + ' ' + str(value))
+        logger.info('total seconds ' + str(report['seconds']) + ' max_rss_bytes ' + str(report['max_rss_bytes']))
@@ -0,0 +1,245 @@
+'''
+This file contains the registry of parameter specifications for the latent health
+model. Each specification was written as a Python file in ParameterSpecs, and
+importing one of those files runs its code and requires ParameterSpecs to be on
+sys.path. Instead, the values of every specification are kept together in a single
+JSON file, ParameterSpecs/SpecRegistry.json, which is read once and then looked up
+by name. Loading a specification has no side effects and does not depend on the
+working directory.
+
+The specification files remain the original source of each specification. After a
+specification file is added or edited, the registry is made again by running:
+
+> python LatentHealthSpecs.py
+
+Every specification is validated when the registry is made and when one is loaded:
+the length of its parameter vector must agree with its number of reporting types,
+whether it has mixed normal health shocks, and its SRHS category counts. The registry
+also keeps a hash of each specification file, and loading a specification whose file
+has changed since the registry was made raises an error rather than returning stale
+values.
+'''
+from copy import copy
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+
+# Directory holding the specification files and the registry
+spec_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ParameterSpecs')
+
+# Name of the registry file in spec_dir
+spec_registry_file = os.path.join(spec_dir, 'SpecRegistry.json')
+
+# Names of values that are kept in the registry for each specification; a value
+# that is not defined in a specification file is kept as None
+spec_value_names = ['x_min', 'x_max', 'x_count', 'data_file', 'source_name', 'figure_label', 'sex_list',
+                    'T_max', 'id_col', 'weight_col', 'age_col', 'sex_col', 'data_init_col', 'measure_count',
+                    'category_counts', 'measure_names', 'age_min', 'age_max', 'age_incr', 'wave_length',
+                    'report_type_count', 'mixed_health_shocks', 'eval_count', 'current_param_vec', 'which_indices']
+
+# Registry of specifications, loaded on first use
+spec_registry = None
+
+
+def countParameters(spec):
+    '''
+    Count the parameters that a specification must have, as read by makeParameterDict.
+
+    Parameters
+    ----------
+    spec : dict
+        Dictionary of specification values, with at least report_type_count,
+        mixed_health_shocks, measure_count, and category_counts.
+
+    Returns
+    -------
+    param_count : int
+        Required length of current_param_vec.
+    '''
+    param_count = 26 + 3*int(spec['mixed_health_shocks']) # Mortality, health, and health shock parameters
+    param_count += 2*(spec['report_type_count'] - 1) # Reporting type standard deviations and probabilities
+    param_count += 2*spec['measure_count'] - 1 # Measure constants and coefficients
+    param_count += sum(C - 2 for C in spec['category_counts']) # Cut points
+    return param_count
+
+
+def hashSpecFile(name):
+    '''
+    Hash the contents of one specification file in spec_dir.
+
+    Parameters
+    ----------
+    name : str
+        Name of the specification, which is the name of its file with no .py extension.
+
+    Returns
+    -------
+    source_hash : str or None
+        SHA-256 hex digest of the file, or None if there is no such file.
+    '''
+    file_name = os.path.join(spec_dir, name + '.py')
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def checkSpecSource(name, spec):
+    '''
+    Check that a specification in the registry was made from the specification file
+    that is now on disk. A specification with no file on disk is not checked.
+
+    Parameters
+    ----------
+    name : str
+        Name of the specification.
+    spec : dict
+        Registry entry for the specification, with its source_hash.
+
+    Returns
+    -------
+    None
+    '''
+    source_hash = hashSpecFile(name)
+    if source_hash is not None and spec.get('source_hash') != source_hash:
+        raise ValueError('Specification file ' + name + '.py has changed since the registry was made; '
+                         + 'run LatentHealthSpecs.py to make the registry again.')
+
+
+def validateSpec(name, spec):
+    '''
+    Check that the values of a specification are consistent with each other.
+
+    Parameters
+    ----------
+    name : str
+        Name of the specification, for error messages.
+    spec : dict
+        Dictionary of specification values.
+
+    Returns
+    -------
+    None
+    '''
+    if len(spec['category_counts']) != spec['measure_count']:
+        raise ValueError('Specification ' + name + ' has ' + str(spec['measure_count']) + ' measures but '
+                         + str(len(spec['category_counts'])) + ' category counts.')
+    param_count = countParameters(spec)
+    if len(spec['current_param_vec']) != param_count:
+        raise ValueError('Specification ' + name + ' has ' + str(len(spec['current_param_vec']))
+                         + ' parameters, but its settings require ' + str(param_count) + '.')
+    which_indices = spec['which_indices']
+    if which_indices is not None and len(which_indices) > 0:
+        if min(which_indices) < 0 or max(which_indices) >= param_count:
+            raise ValueError('Specification ' + name + ' has which_indices outside its parameter vector.')
+
+
+def makeSpecRegistry(output_name=spec_registry_file):
+    '''
+    Make the registry by importing every specification file in ParameterSpecs once,
+    validating it, and writing its values and the hash of its file to a JSON file.
+    This is the only place where specification files are run as code.
+
+    Parameters
+    ----------
+    output_name : str
+        Name of the registry file to write.
+
+    Returns
+    -------
+    registry : dict
+        Dictionary of specifications by name, as written to the file.
+    '''
+    import importlib
+    if spec_dir not in sys.path:
+        sys.path.insert(0, spec_dir)
+    registry = {}
+    for file_name in sorted(os.listdir(spec_dir)):
+        if not file_name.endswith('.py'):
+            continue
+        name = file_name[:-3]
+        spec_module = importlib.import_module(name)
+        spec = {}
+        for value_name in spec_value_names:
+            value = getattr(spec_module, value_name, None)
+            if isinstance(value, np.ndarray):
+                value = value.tolist()
+            spec[value_name] = value
+        validateSpec(name, spec)
+        spec['source_hash'] = hashSpecFile(name)
+        registry[name] = spec
+
+    with open(output_name, 'w') as f:
+        json.dump(registry, f, indent=1)
+        f.close()
+    return registry
+
+
+def loadSpecRegistry():
+    '''
+    Load the registry of specifications from ParameterSpecs/SpecRegistry.json,
+    or return it if it was already loaded.
+
+    Returns
+    -------
+    registry : dict
+        Dictionary of specifications by name, each a dictionary of values.
+    '''
+    global spec_registry
+    if spec_registry is None:
+        with open(spec_registry_file) as f:
+            spec_registry = json.load(f)
+    return spec_registry
+
+
+def listSpecs():
+    '''
+    List the names of all specifications in the registry.
+
+    Returns
+    -------
+    names : [str]
+        Sorted names of the specifications.
+    '''
+    return sorted(loadSpecRegistry().keys())
+
+
+def getSpec(name):
+    '''
+    Look up one specification by name, check that its file has not changed since the
+    registry was made, and validate it.
+
+    Parameters
+    ----------
+    name : str
+        The name of the specification, which is the name of its file in ParameterSpecs
+        with no .py extension.
+
+    Returns
+    -------
+    spec : dict
+        Dictionary of the values in spec_value_names and the source_hash. The
+        parameter vector and which_indices are new numpy arrays, so they can be
+        changed freely.
+    '''
+    registry = loadSpecRegistry()
+    if name not in registry:
+        raise KeyError('There is no specification named ' + name + ' in the registry; if its file was just added '
+                       + 'to ParameterSpecs, run LatentHealthSpecs.py to make the registry again.')
+    spec = copy(registry[name])
+    checkSpecSource(name, spec)
+    validateSpec(name, spec)
+    spec['current_param_vec'] = np.array(spec['current_param_vec'], dtype=float)
+    if spec['which_indices'] is not None:
+        spec['which_indices'] = np.array(spec['which_indices'], dtype=int)
+    for value_name in ['category_counts', 'sex_list', 'measure_names']:
+        if spec[value_name] is not None:
+            spec[value_name] = list(spec[value_name])
+    return spec
+
+
+if __name__ == '__main__':
+    registry = makeSpecRegistry()
+    print('Wrote ' + str(len(registry)) + ' specifications to ' + spec_registry_file + '.')
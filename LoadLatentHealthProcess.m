@@ -38,12 +38,33 @@ global node_count age_count report_count type_count HealthGrid LivPrbArray Trans
 % Name the file to be loaded here
 discretization_file = 'MainResults.dat';
 
-% Open the file and unpack dimension sizes
+% Open the file and unpack dimension sizes. Files in the versioned format begin
+% with the bytes 'LHPF'; see LoadLatentHealthProcess.py for a full description.
+% Files in the original format have dimension sizes in the first four bytes.
+% Values are double precision unless the header records single precision.
 myfile = fopen(discretization_file);
-node_count = fread(myfile,1);
-age_count = fread(myfile,1);
-report_count = fread(myfile,1);
-type_count = fread(myfile,1);
+first_bytes = fread(myfile,4)';
+if isequal(first_bytes, double('LHPF'))
+    file_version = fread(myfile,1,'uint32','b');
+    header_size = fread(myfile,1,'uint32','b');
+    node_count = fread(myfile,1,'uint32','b');
+    age_count = fread(myfile,1,'uint32','b');
+    report_count = fread(myfile,1,'uint32','b');
+    type_count = fread(myfile,1,'uint32','b');
+    dtype_code = fread(myfile,1,'uint32','b');
+    if dtype_code == 2
+        value_type = 'float32';
+    else
+        value_type = 'float64';
+    end
+    fseek(myfile,header_size,'bof');
+else
+    node_count = first_bytes(1);
+    age_count = first_bytes(2);
+    report_count = first_bytes(3);
+    type_count = first_bytes(4);
+    value_type = 'float64';
+end
 
 % Initialize the arrays to be read from file
 HealthGrid = zeros(node_count,1);
@@ -54,7 +75,7 @@ InitialHealthDstn = zeros(2, age_count, node_count);
 
 % Read survival probabilities one by one from the file
 for h = 1:node_count
-    temp = fread(myfile,1,'float64','b');
+    temp = fread(myfile,1,value_type,'b');
     HealthGrid(h) = temp;
 end
 
@@ -62,7 +83,7 @@ end
 for s = 1:2
     for j = 1:age_count
         for h = 1:node_count
-            temp = fread(myfile,1,'float64','b');
+            temp = fread(myfile,1,value_type,'b');
             LivPrbArray(s,j,h) = temp;
         end
     end
@@ -73,7 +94,7 @@ for s = 1:2
     for j = 1:age_count
         for i = 1:node_count
             for h = 1:node_count
-                temp = fread(myfile,1,'float64','b');
+                temp = fread(myfile,1,value_type,'b');
                 TransPrbArray(s,j,i,h) = temp;
             end
         end
@@ -84,7 +105,7 @@ end
 for k = 1:type_count
     for x = 1:report_count
         for h = 1:node_count
-            temp = fread(myfile,1,'float64','b');
+            temp = fread(myfile,1,value_type,'b');
             ReportPrbArray(k,x,h) = temp;
         end
     end
@@ -94,7 +115,7 @@ end
 for s = 1:2
     for j = 1:age_count
         for h = 1:node_count
-            temp = fread(myfile,1,'float64','b');
+            temp = fread(myfile,1,value_type,'b');
             InitialHealthDstn(s,j,h) = temp;
         end
     end
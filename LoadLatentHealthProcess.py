@@ -1,8 +1,8 @@
 '''
 This file loads a discretized latent health process that has been saved to disk
 with the script MakeLatentHealthFile.py. For use cases where multiple discre-
-tizations are needed for the same project, the code below can easily be adapted
-into a function that returns the arrays.
+tizations are needed for the same project, the function loadLatentHealthProcess
+returns the arrays for any named file.
 
 To use, first create a discretized health process with MakeLatentHealthFile.py,
 using the "process" option; see documentation in that file. Make sure the output
@@ -32,53 +32,270 @@ ReportPrbArray : np.array
 InitialHealthDstn : np.array
     Array of shape (2, age_count, nodecount) with the unconditional distribution
     of discretized latent health (conditional on survival) by age-sex.
+
+By default, the arrays are read-only memory-mapped views of the file, with the
+big-endian dtype recorded in it ('>f8' or '>f4'). Nothing is read from disk until
+it is used, and many processes that load the same file share one copy of it in
+the operating system's page cache. Arithmetic on these arrays works as normal,
+but they cannot be written to; use np.array(...) to get an ordinary in-memory
+copy. If the named file does not exist, this file can still be imported to use
+loadLatentHealthProcess.
+
+A structural model that is solved backward by age usually needs the transition
+matrix for only one sex and age at a time. For a fine grid, the class
+LatentHealthProcess reads only those matrices from the file, when they are asked
+for, and keeps a few of the most recently used ones in memory:
+
+>>> MyProcess = LatentHealthProcess('MainResults.dat')
+>>> TransPrbs = MyProcess.trans(s, j)   # Array of shape (node_count, node_count)
+>>> LivPrbs = MyProcess.liv(s, j)       # Array of size node_count
+>>> HealthDstn = MyProcess.init(s, j)   # Array of size node_count
+
+Process files are written in a versioned format. All values are big-endian, and
+the file begins with a header laid out as follows:
+
+bytes 0-3   : The magic bytes b'LHPF'.
+bytes 4-7   : Format version (uint32), currently 2.
+bytes 8-11  : Size of the header in bytes (uint32), a multiple of 8.
+bytes 12-27 : node_count, age_count, report_count, type_count (uint32 each).
+bytes 28-31 : Code for the dtype of the arrays (uint32); 1 means '>f8', 2 means '>f4'.
+bytes 32-71 : Byte offsets from the start of the file of HealthGrid, LivPrbArray,
+              TransPrbArray, ReportPrbArray, and InitialHealthDstn (uint64 each).
+bytes 72-87 : Minimum and maximum values of the latent health grid (float64 each).
+bytes 88-91 : Length of the specification name in bytes (uint32).
+bytes 92-   : Specification name (utf-8), then zeros up to the header size.
+
+The original (version 1) format has a 4-byte header with node_count, age_count,
+report_count, and type_count as single bytes, followed directly by the arrays as
+'>f8'. Files in that format can still be loaded.
 '''
-import numpy as np
 from struct import unpack
+from collections import OrderedDict
+import os
+import numpy as np
+
+# Identifying values for the versioned process file format
+process_file_magic = b'LHPF'
+process_dtype_names = {1 : '>f8', 2 : '>f4'}
+
+
+def readProcessHeader(discretization_file):
+    '''
+    Read the header of a binary file made by MakeLatentHealthFile.py with the
+    "process" option, in either the original or versioned format.
+
+    Parameters
+    ----------
+    discretization_file : str
+        Name of the file to be read.
+
+    Returns
+    -------
+    header : dict
+        Dictionary with the file's format version, grid sizes (node_count, age_count,
+        report_count, type_count), array dtype, byte offsets of the five arrays,
+        and (version 2 only) the specification name and health_min / health_max.
+    '''
+    with open(discretization_file, 'rb') as f:
+        first_bytes = f.read(4)
+        if first_bytes != process_file_magic:
+            # Original format has grid sizes in single bytes, then all arrays
+            node_count, age_count, report_count, type_count = first_bytes
+            header = {'version' : 1, 'spec_name' : None, 'health_min' : None, 'health_max' : None}
+            dtype = '>f8'
+            section_sizes = [node_count,
+                             2*age_count*node_count,
+                             2*age_count*node_count**2,
+                             type_count*report_count*node_count,
+                             2*age_count*node_count]
+            offsets = (4 + 8*np.concatenate(([0], np.cumsum(section_sizes[:-1])))).tolist()
+        else:
+            values = unpack('>IIIIIII5Q2dI', f.read(88))
+            version, header_size, node_count, age_count, report_count, type_count, dtype_code = values[:7]
+            if version != 2:
+                raise ValueError('Process file ' + discretization_file + ' has unknown format version ' + str(version) + '.')
+            offsets = list(values[7:12])
+            dtype = process_dtype_names[dtype_code]
+            header = {'version' : version,
+                      'spec_name' : f.read(values[14]).decode('utf-8'),
+                      'health_min' : values[12],
+                      'health_max' : values[13]}
+        f.close()
+
+    header.update({'node_count' : node_count, 'age_count' : age_count,
+                   'report_count' : report_count, 'type_count' : type_count,
+                   'dtype' : dtype, 'offsets' : offsets})
+    return header
+
+
+def loadLatentHealthProcess(discretization_file, use_memmap=True):
+    '''
+    Load a discretized latent health process from a binary file made by
+    MakeLatentHealthFile.py with the "process" option.
+
+    Parameters
+    ----------
+    discretization_file : str
+        Name of the file to be loaded, in either the original or versioned format.
+    use_memmap : bool
+        Indicator for whether the arrays should be memory-mapped views of the file
+        (default) or views of a private copy of the file read into memory.
+
+    Returns
+    -------
+    HealthGrid : np.array
+        Array of size node_count with the discretized latent health grid.
+    LivPrbArray : np.array
+        Array of shape (2, age_count, node_count) with survival probabilities.
+    TransPrbArray : np.array
+        Array of shape (2, age_count, node_count, node_count) with transition probabilities.
+    ReportPrbArray : np.array
+        Array of shape (type_count, report_count, node_count) with SRHS reporting probabilities.
+    InitialHealthDstn : np.array
+        Array of shape (2, age_count, node_count) with the initial distribution of health.
+    '''
+    header = readProcessHeader(discretization_file)
+    node_count = header['node_count']
+    age_count = header['age_count']
+    report_count = header['report_count']
+    type_count = header['type_count']
+    dtype = np.dtype(header['dtype'])
+    if not use_memmap:
+        with open(discretization_file, 'rb') as f:
+            file_buffer = f.read()
+            f.close()
+
+    # Make a view of each array in the file, at the offsets given in the header
+    shapes = [(node_count,),
+              (2, age_count, node_count),
+              (2, age_count, node_count, node_count),
+              (type_count, report_count, node_count),
+              (2, age_count, node_count)]
+    arrays = []
+    for shape, offset in zip(shapes, header['offsets']):
+        if use_memmap:
+            arrays.append(np.memmap(discretization_file, dtype=dtype, mode='r', offset=offset, shape=shape))
+        else:
+            arrays.append(np.frombuffer(file_buffer, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape))
+
+    HealthGrid, LivPrbArray, TransPrbArray, ReportPrbArray, InitialHealthDstn = arrays
+    return HealthGrid, LivPrbArray, TransPrbArray, ReportPrbArray, InitialHealthDstn
+
+
+class LatentHealthProcess(object):
+    '''
+    A discretized latent health process in a binary file made by MakeLatentHealthFile.py,
+    whose transition matrices are read one sex-age block at a time as they are needed.
+    The grid, survival probabilities, reporting probabilities, and initial health
+    distributions are small, and are read when this object is made.
+
+    Parameters
+    ----------
+    discretization_file : str
+        Name of the file to be loaded, in either the original or versioned format.
+    cache_size : int
+        Number of recently used transition matrices to keep in memory.
+    '''
+    def __init__(self, discretization_file, cache_size=4):
+        header = readProcessHeader(discretization_file)
+        self.discretization_file = discretization_file
+        self.header = header
+        self.node_count = header['node_count']
+        self.age_count = header['age_count']
+        self.report_count = header['report_count']
+        self.type_count = header['type_count']
+        self.file_dtype = np.dtype(header['dtype'])
+        self.dtype = self.file_dtype.newbyteorder('=') # Arrays are returned in native byte order
+        self.cache_size = cache_size
+        self.trans_cache = OrderedDict()
+
+        HealthGrid, LivPrbArray, TransPrbArray, ReportPrbArray, InitialHealthDstn = loadLatentHealthProcess(discretization_file)
+        self.HealthGrid = HealthGrid.astype(self.dtype)
+        self.LivPrbArray = LivPrbArray.astype(self.dtype)
+        self.ReportPrbArray = ReportPrbArray.astype(self.dtype)
+        self.InitialHealthDstn = InitialHealthDstn.astype(self.dtype)
+
+
+    def trans(self, s, j):
+        '''
+        Get the transition matrix for one sex and age, reading it from the file if
+        it is not one of the most recently used.
+
+        Parameters
+        ----------
+        s : int
+            Sex (0 female, 1 male).
+        j : int
+            Index of age.
+
+        Returns
+        -------
+        TransPrbs : np.array
+            Read-only array of shape (node_count, node_count) with the probability of
+            moving from each health state (rows) to each health state (columns).
+        '''
+        key = (int(s), int(j))
+        if key in self.trans_cache:
+            self.trans_cache.move_to_end(key)
+            return self.trans_cache[key]
+        if not ((0 <= key[0] < 2) and (0 <= key[1] < self.age_count)):
+            raise IndexError('Sex must be 0 or 1 and age index must be less than ' + str(self.age_count) + '.')
+
+        block_count = self.node_count**2
+        offset = self.header['offsets'][2] + (key[0]*self.age_count + key[1])*block_count*self.file_dtype.itemsize
+        TransPrbs = np.fromfile(self.discretization_file, dtype=self.file_dtype, count=block_count, offset=offset)
+        TransPrbs = TransPrbs.astype(self.dtype).reshape((self.node_count, self.node_count))
+        TransPrbs.flags.writeable = False # Cached matrices are shared by every caller
+
+        self.trans_cache[key] = TransPrbs
+        if len(self.trans_cache) > self.cache_size:
+            self.trans_cache.popitem(last=False)
+        return TransPrbs
+
+
+    def liv(self, s, j):
+        '''
+        Get survival probabilities for one sex and age.
+
+        Parameters
+        ----------
+        s : int
+            Sex (0 female, 1 male).
+        j : int
+            Index of age.
+
+        Returns
+        -------
+        LivPrbs : np.array
+            Array of size node_count with survival probabilities by health state.
+        '''
+        return self.LivPrbArray[s,j,:]
+
+
+    def init(self, s, j):
+        '''
+        Get the distribution of health for one sex and age.
+
+        Parameters
+        ----------
+        s : int
+            Sex (0 female, 1 male).
+        j : int
+            Index of age.
+
+        Returns
+        -------
+        HealthDstn : np.array
+            Array of size node_count with the distribution of health (conditional
+            on survival) among health states.
+        '''
+        return self.InitialHealthDstn[s,j,:]
+
 
 # Name the file to be loaded here
 discretization_file = 'MainResults.dat'
 
-with open(discretization_file, 'rb') as f:
-    
-    # Write grid sizes to file
-    node_count = int.from_bytes(f.read(1), 'little')
-    age_count = int.from_bytes(f.read(1), 'little')
-    report_count = int.from_bytes(f.read(1), 'little')
-    type_count = int.from_bytes(f.read(1), 'little')
-    
-    # Read the latent health grid from the file
-    HealthGrid = np.zeros(node_count)
-    for h in range(node_count):
-        HealthGrid[h] = unpack('>d', f.read(8))[0]
-        
-    # Read survival probabilities from the file
-    LivPrbArray = np.zeros((2, age_count, node_count))
-    for s in range(2):
-        for j in range(age_count):
-            for h in range(node_count):
-                LivPrbArray[s,j,h] = unpack('>d', f.read(8))[0]
-                
-    # Read transition probabilities from the file
-    TransPrbArray = np.zeros((2, age_count, node_count, node_count))
-    for s in range(2):
-        for j in range(age_count):
-            for i in range(node_count):
-                for h in range(node_count):
-                    TransPrbArray[s,j,i,h] = unpack('>d', f.read(8))[0]
-                    
-    # Read SRHS reporting probabilities from the file
-    ReportPrbArray = np.zeros((type_count, report_count, node_count))
-    for k in range(type_count):
-        for x in range(report_count):
-            for h in range(node_count):
-                ReportPrbArray[k,x,h] = unpack('>d', f.read(8))[0]
-                
-    # Read initial health distributions from the file
-    InitialHealthDstn = np.zeros((2, age_count, node_count))
-    for s in range(2):
-        for j in range(age_count):
-            for h in range(node_count):
-                InitialHealthDstn[s,j,h] = unpack('>d', f.read(8))[0]
-    
-    f.close()
\ No newline at end of file
+if os.path.exists(discretization_file):
+    HealthGrid, LivPrbArray, TransPrbArray, ReportPrbArray, InitialHealthDstn = loadLatentHealthProcess(discretization_file)
+    type_count, report_count, node_count = ReportPrbArray.shape
+    age_count = LivPrbArray.shape[1]
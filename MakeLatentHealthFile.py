@@ -51,11 +51,48 @@ waves long), based on the main specification estimated in the paper, can be made
     
 > python MakeLatentHealthFile.py filter TwoStudyAllOver23HeteroParams ConditionalHealthDstn.txt 120 -12 28 3
 
-Alternatively, the line 'my_args = sys.argv' near the top of the code can be
+The "filter" option can also be given the argument --workers N (anywhere after the
+script name) to divide the work among N processes. The output is the same.
+
+Either worktype can also be given the argument --cache DIR to keep the built arrays
+in a disk cache in directory DIR; a later job with the same specification and
+discretization then loads them from the cache instead of building them again.
+See LatentHealthCache.py for details.
+
+Either worktype can also be given the argument --profile REPORT to write a JSON
+file named REPORT with the time spent in each stage of work, peak memory use, and
+counts of work done, such as SRHS sequences filtered and matrix products. Adding
+--trace-memory also measures memory allocated in each stage, which is slower.
+See LatentHealthProfile.py for details.
+
+For fine grids, either worktype can be given the argument --trans-tol TOL to drop
+transition probabilities below TOL (such as 1e-12) and store each transition matrix
+sparsely, which uses far less memory and makes the filter faster. The largest change
+to any row of a transition matrix is printed at the end.
+
+Either worktype can also be given the argument --dtype float32 to build, write, and
+filter with single precision probabilities, which halves the size of a process file.
+The dtype is recorded in the process file, and LoadLatentHealthProcess.py reads it.
+
+If output_name for the "filter" option ends in .npz, .parquet, or .feather, the same
+columns are instead written as typed arrays in that format, which can be read far
+faster than text. Parquet and Feather output require the pyarrow package.
+
+Alternatively, the line 'my_args = sys.argv' at the bottom of the code can be
 commented out, and the nearby line defining my_args can be uncommented and edited.
 This allows the script to be run with no additional arguments, if preferred.
 The three examples above are included in the code (commented out).
 
+The same work can be done from within Python by importing this module, which has
+no side effects on import. Each LatentHealthModel instance holds one specification
+and discretization, so many discretizations can be made in a single session:
+
+>>> from MakeLatentHealthFile import LatentHealthModel
+>>> MyModel = LatentHealthModel('TwoStudyAllOver23HeteroParams', 40, -6., 22.)
+>>> MyModel.build()
+>>> MyModel.write_process('MainResults.dat')
+>>> MyModel.filter('ConditionalHealthDstn.txt', 3)
+
 Once a discretization has been made with this script, it can be read from disk
 using the file LoadLatentHealthProcess.py; see documentation in that file. The
 "filtration" data can be loaded into Stata with the insheet command, sorted,
@@ -63,78 +100,48 @@ and then merged (many-to-one) into a panel dataset with SRHS observations.
 '''
 from struct import pack
 from time import time
+from copy import copy
+from collections import OrderedDict
+from math import perm, factorial
+from multiprocessing import Pool
+import os
 import sys
+import hashlib
 import numpy as np
 import itertools
-from scipy.stats import norm
-from scipy.special import perm, factorial
-sys.path.insert(0, './ParameterSpecs')
-
-# Get system arguments
-my_args = sys.argv
-#my_args = [None, 'process', 'TwoStudyAllOver23HeteroParams', 'MainResults.dat', '40', '-6', '22']
-#my_args = [None, 'process', 'TwoStudyAllTinyParams', 'TinyResults.dat', '15', '-6', '22']
-#my_args = [None, 'filter', 'TwoStudyAllOver23HeteroParams', 'ConditionalHealthDstn.txt', '120', '-12', '28', '3']
-
-# Process required arguments
-if len(my_args) < 4:
-    print('Please read the documentation at the top of MakeLatentHealthProcess.py to use this file.')
-worktype = my_args[1]
-spec_name = my_args[2]
-output_name = my_args[3]
-if not ((worktype == 'filter') or (worktype == 'process')):
-    print('First passed argument should be "filter" or "process"; please read the documentation at the top of MakeLatentHealthProcess.py.')
-    print('Code will not produce any output file.')
-
-# Initialize a bunch of variables, which will be overwritten. This exists solely so that Spyder doesn't flag a bunch of stuff as errors.
-measure_count = None
-category_counts = None
-report_type_count = None
-mixed_health_shocks = None
-current_param_vec = None
-age_min = None
-age_max = None
-age_incr = None
-x_min = None
-x_max = None
-x_count = None
-source_name = None
-wave_length = None
-
-# Import parameters to be used to construct discretized latent health process
+from LatentHealthCache import ProbArrayCache
+from LatentHealthProfile import StageProfiler
+from LatentHealthSpecs import getSpec
+
+# Importing scipy takes longer than a small job, so scipy.special and scipy.sparse are
+# imported only within the methods that use them; loading cached arrays needs neither
+
+# Version of the code that builds the probability arrays; this is part of the key
+# for cached arrays, so it must be changed whenever the arrays that are built change
+__version__ = '2.0'
+
+# Maximum number of elements in the temporary arrays made by makeTransProbArray
+trans_block_size = 2**20
+
+# Identifying values for the versioned process file format; these must agree with
+# the values in LoadLatentHealthProcess.py, which describes the format in detail
+process_file_magic = b'LHPF'
+process_file_version = 2
+process_dtype_codes = {'>f8' : 1, '>f4' : 2}
+
+# Maximum total size of the fused survival and transition matrices kept by each model
+propagator_cache_bytes = 2**28
+
+# Names of arrays that are put in shared memory for a parallel filter
+shared_array_names = ['LivPrbArray', 'TransPrbArray', 'ReportPrbArray', 'HealthInitDstn']
+
+# Names of data and estimation settings that are taken from a specification, if present
+data_import_list = ['data_file', 'id_col', 'weight_col', 'age_col', 'sex_col', 'data_init_col', 'T_max',
+                    'eval_count', 'which_indices', 'sex_list']
+
+# Names of values that are taken from a specification
 import_list = ['measure_count', 'category_counts', 'report_type_count', 'mixed_health_shocks', 'wave_length',\
                'current_param_vec', 'age_min', 'age_max', 'age_incr', 'x_min', 'x_max', 'x_count', 'source_name']
-import_command = 'from ' + spec_name + ' import '
-for j in range(len(import_list)):
-    import_command += import_list[j] + ', '
-import_command = import_command[:-2]
-exec(import_command)
-
-# Calculate some basic values from the exogenous parameters
-report_count = np.sum(category_counts)
-measure_starts = np.concatenate((np.array([0]),np.cumsum(category_counts)[:-1]))
-h_count = category_counts[0] # Number of SRHS categories
-x_count_cond = x_count // report_type_count
-
-# Account for optional parameters
-if len(my_args) > 4:
-    x_count_cond = int(my_args[4])
-    x_count = x_count_cond*report_type_count
-if len(my_args) > 5:
-    x_min = float(my_args[5])
-if len(my_args) > 6:
-    x_max = float(my_args[6])
-if len(my_args) > 7:
-    Z_to_cond = int(my_args[7])
-
-# Define the cut points for the continuous health variable x, and the midpoints
-if x_count % report_type_count > 0:
-    print('x_count is not divisible by report_type_count, code will break!')
-x_cuts = np.linspace(x_min,x_max,num=x_count_cond+1)
-x_grid = (x_cuts[1:] + x_cuts[:-1])/2.
-x_step = x_grid[1] - x_grid[0]
-x_grid_rep = np.tile(x_grid, report_type_count)
-age_count_A = int((age_max - age_min)/age_incr + 1)
 
 def mystr(x):
     return "{:.3f}".format(x)
@@ -168,717 +175,1962 @@ def changeTaylorToPoly(taylor, x0):
     return coeffs
 
 
-# Define the function to produce survival probabilities
-def makeLivPrbArray(age_min,age_max,age_incr,Mort0,MortSex,MortHealth1,MortHealth2,
-                    MortHealth3,MortHealth4,MortAge1,MortAge2,MortAge3,MortAge4,
-                    MortHealthAge,MortSexAge):
+class LatentHealthModel(object):
     '''
-    Make a 3D array of survival probabilitities: sex X age X health.  Uses given
-    parameters and boundaries for the age range.
+    A discretized latent health process for one specification of the model. All
+    grid sizes and grids that were formerly globals of this script are attributes
+    of the instance, so that any number of models can coexist in one session.
     
     Parameters
     ----------
-    age_min : float
-        Minimum value that age takes on in model.
-    age_max : float
-        Maximum value that age takes on in model.
-    age_incr : float
-        Increment for age in the model.
-    Mort0 : float
-        Constant in mortality probit function.
-    MortSex : float
-        Shifter for being male in mortality probit function.
-    MortHealth1 : float
-        Linear coefficient on health in mortality probit function.
-    MortHealth2 : float
-        Quadratic coefficient on health in mortality probit function.
-    MortHealth3 : float
-        Cubic coefficient on health in mortality probit function.
-    MortHealth4 : float
-        Quartic coefficient on health in mortality probit function.
-    MortAge1 : float
-        Linear coefficient on age in mortality probit function.
-    MortAge2 : float
-        Quadratic coefficient on age in mortality probit function.
-    MortAge3 : float
-        Cubic coefficient on age in mortality probit function.
-    MortAge4 : float
-        Quartic coefficient on age in mortality probit function.
-    MortHealthAge : float
-        Interaction term between health and age in mortality probit function.
-    MortSexAge : float
-        Interaction term between health and sex in mortality probit function.
-        
-    Returns
-    -------
-    LivPrbArray : np.array
-        Array of shape (2,age_count,x_count) with survival probabilities.
+    spec : str
+        The name of the specification in ParameterSpecs, with no .py extension; its
+        values are looked up in the registry (see LatentHealthSpecs.py).
+    node_count : int or None
+        Number of nodes in the latent health discretization for each reporting type.
+        If None, the grid size in the specification file is used.
+    health_min : float or None
+        Minimum value of latent health in the discretization. If None, the value
+        in the specification file is used.
+    health_max : float or None
+        Maximum value of latent health in the discretization. If None, the value
+        in the specification file is used.
+    trans_tol : float or None
+        If not None, transition probabilities below this value are dropped, and
+        each transition matrix is stored as a sparse matrix; see makeTransProbArray.
+    dtype : str or np.dtype
+        Precision of the probability arrays, either 'float64' (default) or 'float32'.
+        This also sets the precision of process files and of the filter's work.
     '''
-    ThetaFunc = lambda s,j,x : Mort0 + MortSex*s + MortHealth1*x + MortHealth2*x**2 + MortHealth3*x**3 + MortHealth4*x**4 + MortAge1*j + MortAge2*j**2 + MortAge3*j**3 + MortAge4*j**4 + MortHealthAge*j*x + MortSexAge*s*j
-    age_count = int(np.round((age_max - age_min)/age_incr)) + 1
-    
-    AgeVec = np.linspace(age_min,age_max,num=age_count)
-    AgeArray = np.tile(np.reshape(AgeVec,(1,age_count,1)),(1,1,x_count_cond))
-    xArray = np.tile(np.reshape(x_grid,(1,1,x_count_cond)),(1,age_count,1))
-    
-    thetaArray = np.zeros((2,age_count,x_count_cond))
-    thetaArray[0,:,:] = ThetaFunc(0,AgeArray,xArray)
-    thetaArray[1,:,:] = ThetaFunc(1,AgeArray,xArray)
+    def __init__(self, spec, node_count=None, health_min=None, health_max=None, trans_tol=None, dtype='float64'):
+        spec_values = getSpec(spec)
+        self.spec_name = spec
+        for name in import_list + data_import_list:
+            setattr(self, name, spec_values[name])
+        
+        # Calculate some basic values from the exogenous parameters
+        self.report_count = np.sum(self.category_counts)
+        self.measure_starts = np.concatenate((np.array([0]),np.cumsum(self.category_counts)[:-1]))
+        self.h_count = self.category_counts[0] # Number of SRHS categories
+        self.x_count_cond = self.x_count // self.report_type_count
+        
+        # Account for optional parameters
+        if node_count is not None:
+            self.x_count_cond = int(node_count)
+            self.x_count = self.x_count_cond*self.report_type_count
+        if health_min is not None:
+            self.x_min = float(health_min)
+        if health_max is not None:
+            self.x_max = float(health_max)
+        
+        # Define the cut points for the continuous health variable x, and the midpoints
+        if self.x_count % self.report_type_count > 0:
+            print('x_count is not divisible by report_type_count, code will break!')
+        self.x_cuts = np.linspace(self.x_min,self.x_max,num=self.x_count_cond+1)
+        self.x_grid = (self.x_cuts[1:] + self.x_cuts[:-1])/2.
+        self.x_step = self.x_grid[1] - self.x_grid[0]
+        self.x_grid_rep = np.tile(self.x_grid, self.report_type_count)
+        self.age_count_A = int((self.age_max - self.age_min)/self.age_incr + 1)
+        self.trans_tol = trans_tol
+        self.truncation_report = None
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in [np.float64, np.float32]:
+            raise ValueError('The dtype of a latent health model must be float64 or float32.')
+        
+        # The probability arrays are made by the build method
+        self.param_dict = None
+        self.LivPrbArray = None
+        self.TransPrbArray = None
+        self.ReportPrbArray = None
+        self.HealthInitDstn = None
 
-    LivPrbArray = norm.cdf(thetaArray)
-    return LivPrbArray
+        # Stages of work are only timed and counted if this profiler is enabled
+        self.profiler = StageProfiler()
 
+        # Number of times panelLogLikelihood has been evaluated
+        self.likelihood_eval_count = 0
 
-# Define the function that constructs the array of transition probabilities
-def makeTransProbArray(age_min,age_max,age_incr,Corr0,CorrAge1,CorrAge2,CorrAge3,
-                       CorrAge4,Health0,HealthSex,HealthAge1,HealthAge2,HealthAge3,
-                       HealthAge4,HealthAgeSex,HealthShockAvgs,HealthShockStds,HealthShockPrbs):
-    '''
-    Make a 4D array of health transition probabilities: sex X age X x_t X x_t+1.
-    
-    Parameters
-    ----------
-    age_min : float
-        Minimum value that age takes on in model.
-    age_max : float
-        Maximum value that age takes on in model.
-    age_incr : float
-        Increment for age in the model.
-    Corr0 : float
-        Constant in correlation coefficient function.
-    CorrAge1 : float
-        Linear coefficient on age in correlation coefficient function.
-    CorrAge2 : float
-        Quadratic coefficient on age in correlation coefficient function.
-    CorrAge3 : float
-        Cubic coefficient on age in correlation coefficient function.
-    CorrAge4 : float
-        Quartic coefficient on age in correlation coefficient function.
-    Health0 : float
-        Constant in expected next health function.
-    HealthSex : float
-        Shifter for sex in expected next health function.
-    HealthAge1 : float
-        Linear coefficient in expected next health function.
-    HealthAge2 : float
-        Quadratic coefficient in expected next health function.
-    HealthAge3 : float
-        Cubic coefficient in expected next health function.
-    HealthAge4 : float
-        Quartic coefficient in expected next health function.
-    HealthAgeSex : float
-        Interaction between age and sex in expected next health function.
-    HealthShockAvgs : [float]
-        Vector of health shock means; should have overall mean 0 when weighting by probs.
-    HealthShockStds : [float]
-        Vector of health shock means; should have overall std 1 when weighting by probs.
-    HealthShockPrbs : [float]
-        Vector of weights for the mixed normal health shocks, summing to 1.
-    
-    Returns
-    -------
-    TransPrbArray : np.array
-        Array of shape (2,age_count,x_count,x_count) with transition probabilities
-        between health states at each sex and age.
-    '''
-    # Make correlation vector by age
-    AgeVec = np.linspace(age_min,age_max,num=age_count_A)
-    CorrVecBase = Corr0 + CorrAge1*AgeVec + CorrAge2*AgeVec**2 + CorrAge3*AgeVec**3 + CorrAge4*AgeVec**4
-    CorrVec = np.exp(CorrVecBase)/(1. + np.exp(CorrVecBase))
-    
-    # Make end points of grid go to infinity
-    x_cuts_temp = x_cuts.copy()
-    x_cuts_temp[0] = -np.inf
-    x_cuts_temp[-1] = np.inf
-    x_cuts_tiled = np.tile(np.reshape(x_cuts_temp,(1,x_count_cond+1)),(x_count_cond,1))
-    
-    TransPrbArray = np.zeros((2,age_count_A,x_count_cond,x_count_cond))
-    N = len(HealthShockPrbs)
-    for s in range(2):
-        for j in range(age_count_A):
-            Age = AgeVec[j]
-            Corr = CorrVec[j]
-            ExpHealthBase = Health0 + HealthAge1*Age + HealthAge2*Age**2 + HealthAge3*Age**3 + HealthAge4*Age**4 + HealthSex*s + HealthAgeSex*s*Age
-            ExpHealthNext = Corr*x_grid + (1.-Corr)*ExpHealthBase
-            ExpHealthNext_tiled = np.tile(np.reshape(ExpHealthNext,(x_count_cond,1)),(1,x_count_cond+1))
+        # Fused survival and transition matrices over several periods, made as needed
+        self.propagator_max_bytes = propagator_cache_bytes
+        self.clearPropagators()
+
+    # Define the function to produce survival probabilities
+    def makeLivPrbArray(self,age_min,age_max,age_incr,Mort0,MortSex,MortHealth1,MortHealth2,
+                        MortHealth3,MortHealth4,MortAge1,MortAge2,MortAge3,MortAge4,
+                        MortHealthAge,MortSexAge):
+        '''
+        Make a 3D array of survival probabilitities: sex X age X health.  Uses given
+        parameters and boundaries for the age range.
+
+        Parameters
+        ----------
+        age_min : float
+            Minimum value that age takes on in model.
+        age_max : float
+            Maximum value that age takes on in model.
+        age_incr : float
+            Increment for age in the model.
+        Mort0 : float
+            Constant in mortality probit function.
+        MortSex : float
+            Shifter for being male in mortality probit function.
+        MortHealth1 : float
+            Linear coefficient on health in mortality probit function.
+        MortHealth2 : float
+            Quadratic coefficient on health in mortality probit function.
+        MortHealth3 : float
+            Cubic coefficient on health in mortality probit function.
+        MortHealth4 : float
+            Quartic coefficient on health in mortality probit function.
+        MortAge1 : float
+            Linear coefficient on age in mortality probit function.
+        MortAge2 : float
+            Quadratic coefficient on age in mortality probit function.
+        MortAge3 : float
+            Cubic coefficient on age in mortality probit function.
+        MortAge4 : float
+            Quartic coefficient on age in mortality probit function.
+        MortHealthAge : float
+            Interaction term between health and age in mortality probit function.
+        MortSexAge : float
+            Interaction term between health and sex in mortality probit function.
+
+        Returns
+        -------
+        LivPrbArray : np.array
+            Array of shape (2,age_count,x_count) with survival probabilities.
+        '''
+        from scipy.special import ndtr
+        ThetaFunc = lambda s,j,x : Mort0 + MortSex*s + MortHealth1*x + MortHealth2*x**2 + MortHealth3*x**3 + MortHealth4*x**4 + MortAge1*j + MortAge2*j**2 + MortAge3*j**3 + MortAge4*j**4 + MortHealthAge*j*x + MortSexAge*s*j
+        age_count = int(np.round((age_max - age_min)/age_incr)) + 1
+
+        AgeVec = np.linspace(age_min,age_max,num=age_count)
+        AgeArray = np.tile(np.reshape(AgeVec,(1,age_count,1)),(1,1,self.x_count_cond))
+        xArray = np.tile(np.reshape(self.x_grid,(1,1,self.x_count_cond)),(1,age_count,1))
+
+        thetaArray = np.zeros((2,age_count,self.x_count_cond))
+        thetaArray[0,:,:] = ThetaFunc(0,AgeArray,xArray)
+        thetaArray[1,:,:] = ThetaFunc(1,AgeArray,xArray)
+
+        LivPrbArray = ndtr(thetaArray)
+        return LivPrbArray
+
+
+    # Define the function that constructs the array of transition probabilities
+    def makeTransProbArray(self,age_min,age_max,age_incr,Corr0,CorrAge1,CorrAge2,CorrAge3,
+                           CorrAge4,Health0,HealthSex,HealthAge1,HealthAge2,HealthAge3,
+                           HealthAge4,HealthAgeSex,HealthShockAvgs,HealthShockStds,HealthShockPrbs):
+        '''
+        Make a 4D array of health transition probabilities: sex X age X x_t X x_t+1.
+
+        If this instance has a trans_tol, each row of each transition matrix instead
+        keeps only the probabilities of at least trans_tol, which are most of its mass
+        for a fine grid, and is renormalized to sum to one. The matrices are stored
+        sparsely, so the full dense array is never made. How much each row changes
+        is recorded in the attribute truncation_report.
+
+        Parameters
+        ----------
+        age_min : float
+            Minimum value that age takes on in model.
+        age_max : float
+            Maximum value that age takes on in model.
+        age_incr : float
+            Increment for age in the model.
+        Corr0 : float
+            Constant in correlation coefficient function.
+        CorrAge1 : float
+            Linear coefficient on age in correlation coefficient function.
+        CorrAge2 : float
+            Quadratic coefficient on age in correlation coefficient function.
+        CorrAge3 : float
+            Cubic coefficient on age in correlation coefficient function.
+        CorrAge4 : float
+            Quartic coefficient on age in correlation coefficient function.
+        Health0 : float
+            Constant in expected next health function.
+        HealthSex : float
+            Shifter for sex in expected next health function.
+        HealthAge1 : float
+            Linear coefficient in expected next health function.
+        HealthAge2 : float
+            Quadratic coefficient in expected next health function.
+        HealthAge3 : float
+            Cubic coefficient in expected next health function.
+        HealthAge4 : float
+            Quartic coefficient in expected next health function.
+        HealthAgeSex : float
+            Interaction between age and sex in expected next health function.
+        HealthShockAvgs : [float]
+            Vector of health shock means; should have overall mean 0 when weighting by probs.
+        HealthShockStds : [float]
+            Vector of health shock means; should have overall std 1 when weighting by probs.
+        HealthShockPrbs : [float]
+            Vector of weights for the mixed normal health shocks, summing to 1.
+
+        Returns
+        -------
+        TransPrbArray : np.array or [[scipy.sparse.csr_array]]
+            Array of shape (2,age_count,x_count,x_count) with transition probabilities
+            between health states at each sex and age. If trans_tol is not None, this
+            is instead a nested list of sparse matrices, indexed as TransPrbArray[s][j].
+        '''
+        from scipy.special import ndtr
+        if self.trans_tol is not None:
+            from scipy.sparse import csr_array
+
+        # Make correlation vector by age
+        AgeVec = np.linspace(age_min,age_max,num=self.age_count_A)
+        CorrVecBase = Corr0 + CorrAge1*AgeVec + CorrAge2*AgeVec**2 + CorrAge3*AgeVec**3 + CorrAge4*AgeVec**4
+        CorrVec = np.exp(CorrVecBase)/(1. + np.exp(CorrVecBase))
+
+        # Make expected next health by sex, age, and current health: (2,age_count,x_count)
+        SexArray = np.reshape(np.array([0.,1.]),(2,1))
+        AgeArray = np.reshape(AgeVec,(1,self.age_count_A))
+        ExpHealthBase = Health0 + HealthAge1*AgeArray + HealthAge2*AgeArray**2 + HealthAge3*AgeArray**3 + HealthAge4*AgeArray**4 + HealthSex*SexArray + HealthAgeSex*SexArray*AgeArray
+        CorrArray = np.reshape(CorrVec,(1,self.age_count_A,1))
+        ExpHealthNext = CorrArray*np.reshape(self.x_grid,(1,1,self.x_count_cond)) + (1.-CorrArray)*ExpHealthBase[:,:,np.newaxis]
+
+        # Make end points of grid go to infinity
+        x_cuts_temp = self.x_cuts.copy()
+        x_cuts_temp[0] = -np.inf
+        x_cuts_temp[-1] = np.inf
+
+        # Reshape shock components to broadcast against (N,2,age_count,x_count,x_count+1)
+        N = len(HealthShockPrbs)
+        ShockAvgs = np.reshape(np.asarray(HealthShockAvgs),(N,1,1,1,1))
+        ShockStds = np.reshape(np.asarray(HealthShockStds),(N,1,1,1,1))
+
+        # Do all sexes, ages, and shock components at once, in blocks of ages to limit memory
+        if self.trans_tol is None:
+            TransPrbArray = np.zeros((2,self.age_count_A,self.x_count_cond,self.x_count_cond))
+        else:
+            TransPrbArray = [[None for j in range(self.age_count_A)] for s in range(2)]
+            nonzero_count = 0
+            max_dropped = 0.
+        ages_per_block = max(1, trans_block_size // (N*2*self.x_count_cond*(self.x_count_cond+1)))
+        for bot in range(0, self.age_count_A, ages_per_block):
+            top = min(bot + ages_per_block, self.age_count_A)
+            ExpHealthNext_block = ExpHealthNext[np.newaxis,:,bot:top,:,np.newaxis]
+            distance_array = (x_cuts_temp - (ExpHealthNext_block + ShockAvgs))/ShockStds
+            these = distance_array[...,:-1] < 4.0 # Use survival function in the upper tail for accuracy
+
+            # Only evaluate the CDF and SF at cut points that are actually used
+            CDF_array = np.zeros_like(distance_array)
+            SF_array = np.zeros_like(distance_array)
+            use_cdf = np.zeros(distance_array.shape, dtype=bool)
+            use_cdf[...,:-1] = these
+            use_cdf[...,1:] |= these
+            use_sf = np.zeros(distance_array.shape, dtype=bool)
+            use_sf[...,:-1] = np.logical_not(these)
+            use_sf[...,1:] |= np.logical_not(these)
+            CDF_array[use_cdf] = ndtr(distance_array[use_cdf])
+            SF_array[use_sf] = ndtr(-distance_array[use_sf])
+            prob_array_base = np.where(these, CDF_array[...,1:] - CDF_array[...,:-1], SF_array[...,:-1] - SF_array[...,1:])
+            prob_array = prob_array_base/np.sum(prob_array_base,axis=-1,keepdims=True)
+            if self.trans_tol is None:
+                for n in range(N):
+                    TransPrbArray[:,bot:top,:,:] += HealthShockPrbs[n]*prob_array[n]
+                continue
+
+            # Drop small probabilities from this block of ages, then store each matrix sparsely
+            TransPrbBlock = np.zeros(prob_array.shape[1:])
             for n in range(N):
-                distance_array = (x_cuts_tiled - (ExpHealthNext_tiled + HealthShockAvgs[n]))/HealthShockStds[n]
-                CDF_array = norm.cdf(distance_array)
-                SF_array  = norm.sf(distance_array)
-                these = distance_array[:,:-1] < 4.0
-                prob_array_base = np.zeros((x_count_cond,x_count_cond))
-                prob_array_base[these] = CDF_array[:,1:][these] - CDF_array[:,:-1][these]
-                these = np.logical_not(these)
-                prob_array_base[these] = SF_array[:,:-1][these] - SF_array[:,1:][these]
-                sum_array = np.tile(np.reshape(np.sum(prob_array_base,axis=1),(x_count_cond,1)),(1,x_count_cond))
-                prob_array = prob_array_base/sum_array
-                TransPrbArray[s,j,:,:] += HealthShockPrbs[n]*prob_array
-
-    return TransPrbArray
-
-
-# Define the function that constructs categorical health observation probabilities
-def makeReportPrbArray(Constants,Coeffs,CutLists,ReportStds):
-    '''
-    Make an array with the probability of reporting each categorical response
-    from each value on the x_grid, for each measure.
-    
-    Parameters
-    ----------
-    Constants : np.array
-        Level shifter for each measure in mapping from x to report probit.
-    Coeffs : np.array
-        Linear coefficient for each measure in mapping from x to report probit.
-    CutLists : [np.array]
-        List of arrays of size (category_count[j]-2) cutoff points in the space
-        of x.  The lowest cut point for each measure is assumed to be zero.
-    ReportStds : np.array
-        Array of SRHS reporting error standard deviations.
+                TransPrbBlock += HealthShockPrbs[n]*prob_array[n]
+            keep = TransPrbBlock >= self.trans_tol
+            keep |= TransPrbBlock == np.max(TransPrbBlock, axis=-1, keepdims=True) # Never drop a whole row
+            dropped = np.sum(np.where(keep, 0., TransPrbBlock), axis=-1)
+            TransPrbBlock = np.where(keep, TransPrbBlock, 0.)/(1. - dropped[...,np.newaxis])
+            for s in range(2):
+                for j in range(bot, top):
+                    TransPrbArray[s][j] = csr_array(TransPrbBlock[s,j-bot])
+            nonzero_count += np.sum(keep)
+            max_dropped = max(max_dropped, np.max(dropped))
+
+        if self.trans_tol is not None:
+            self.truncation_report = {
+                'tolerance' : self.trans_tol,
+                'nonzero_share' : nonzero_count/(2.*self.age_count_A*self.x_count_cond**2),
+                'max_dropped_mass' : max_dropped,
+                'max_row_error' : 2.*max_dropped, # L1 distance between original and renormalized rows
+                }
+        return TransPrbArray
+
+
+    # Define the function that constructs categorical health observation probabilities
+    def makeReportPrbArray(self,Constants,Coeffs,CutLists,ReportStds):
+        '''
+        Make an array with the probability of reporting each categorical response
+        from each value on the x_grid, for each measure.
+
+        Parameters
+        ----------
+        Constants : np.array
+            Level shifter for each measure in mapping from x to report probit.
+        Coeffs : np.array
+            Linear coefficient for each measure in mapping from x to report probit.
+        CutLists : [np.array]
+            List of arrays of size (category_count[j]-2) cutoff points in the space
+            of x.  The lowest cut point for each measure is assumed to be zero.
+        ReportStds : np.array
+            Array of SRHS reporting error standard deviations.
+
+        Returns
+        -------
+        ReportPrbArray : np.array
+            Array of shape (type_count,report_count,x_count_cond) with the probability of reporting
+            each categorical answer for each measure when the individual's true health is x.
+        '''
+        from scipy.special import ndtr
+        ReportPrbArray = np.zeros((self.report_count,self.x_count)) + np.nan
+
+        pos = 0
+        for j in range(self.measure_count):
+            Const = Constants[j]
+            Coeff = Coeffs[j]
+            CutList = np.cumsum(CutLists[j])
+            c_count = self.category_counts[j]
+
+            Cuts_plus = np.concatenate(([-np.inf,0.0],CutList,[np.inf]))
+            Cuts_tiled = np.tile(np.reshape(Cuts_plus,(1,c_count+1)),(self.x_count_cond,1))
+            y_grid = Const + Coeff*self.x_grid
+            y_grid_tiled = np.tile(np.reshape(y_grid,(self.x_count_cond,1)),(1,c_count+1))
+            distance_array = (Cuts_tiled - y_grid_tiled)
+
+            if j == 0: # If this measure is SRHS, then use different reporting error std for each type
+                for n in range(self.report_type_count):
+                    distance_array_temp = distance_array / ReportStds[n]
+                    CDF_array = ndtr(distance_array_temp)
+                    ReportPrbArray[pos:(pos+c_count),(n*self.x_count_cond):((n+1)*self.x_count_cond)] = np.transpose(CDF_array[:,1:] - CDF_array[:,:-1])
+            else: # For all other measures, use standard normal reporting error
+                CDF_array = ndtr(distance_array)
+                ReportPrbArray[pos:(pos+c_count),:] = np.tile(np.transpose(CDF_array[:,1:] - CDF_array[:,:-1]), self.report_type_count)
+
+            pos += c_count
+
+        # Reshape the reporting probabilities and return it
+        ReportPrbArrayX = np.zeros((self.report_type_count, self.report_count, self.x_count_cond))
+        for k in range(self.report_type_count):
+            bot = k*self.x_count_cond
+            top = (k+1)*self.x_count_cond
+            for h in range(self.report_count):
+                ReportPrbArrayX[k,h,:] = ReportPrbArray[h,bot:top]
+        return ReportPrbArrayX
+
+
+    # Define the function that constructs the distribution of health for individuals
+    # when they are first observed in the data
+    def makeInitialHealthDstn(self,LivPrbArray,TransPrbArray,xInitMean,xInitStd,TypePrbs):
+        '''
+        Make an array with the unconditional distribution of the continuous health
+        state x for someone who has been observed for the first time.
+
+        Parameters
+        ----------
+        LivPrbArray : np.array
+            Survival probabilities at each sex, age, and health state.
+        TransPrbArray : np.array or [[scipy.sparse.csr_array]]
+            Transitions probabilities at each sex, age, and health state combination,
+            as a dense array or a nested list of sparse matrices.
+        xInitMean : float
+            Mean of health at the earliest age in the model.
+        xInitStd : float
+            Standard devation of health at the earliest age in the model.
+        TypePrbs : np.array
+            Array of population shares of each reporting type (should sum to 1).
+
+        Returns
+        -------
+        InitialHealthDstn : np.array
+            Array of shape (2,age_count,x_count) with the unconditional distribution
+            of continuous health x at age j and sex s.
+        '''
+        from scipy.special import ndtr
+        T = LivPrbArray.shape[1]
+        InitialHealthDstn = np.zeros((2,T,self.x_count_cond))
+
+        # Approximate the distribution of health at the earliest age in the model
+        distances = (self.x_cuts - xInitMean)/xInitStd
+        distances[0] = -20.
+        distances[-1] = 20.
+        CDFs = ndtr(distances)
+        prob_base = CDFs[1:] - CDFs[:-1]
+        HealthDstn0 = prob_base/np.sum(prob_base)
+
+        # Loop over the two sexes
+        for s in range(2):
+            HealthDstnNow = HealthDstn0.copy()
+            for j in range(T):
+                InitialHealthDstn[s,j,:] = HealthDstnNow
+                LivPrbs = LivPrbArray[s,j,:self.x_count_cond]
+                TempDstn = HealthDstnNow*LivPrbs
+                HealthDstnNow = TempDstn/np.sum(TempDstn)
+                TransPrbs = TransPrbArray[s][j] # Either a dense or sparse matrix
+                HealthDstnNow = TransPrbs.T @ HealthDstnNow
+
+        return InitialHealthDstn
+
+
+    # Define the function that constructs arrays for the LL evaluation
+    def makeProbArrays(self,age_min,age_max,age_incr,Mort0,MortSex,MortHealth1,MortHealth2,
+                       MortHealth3,MortHealth4,MortAge1,MortAge2,MortAge3,MortAge4,
+                       MortHealthAge,MortSexAge,Corr0,CorrAge1,CorrAge2,CorrAge3,
+                       CorrAge4,Health0,HealthSex,HealthAge1,HealthAge2,HealthAge3,
+                       HealthAge4,HealthAgeSex,HealthShockAvgs,HealthShockStds,
+                       HealthShockPrbs,ReportConstants,ReportCoeffs,ReportCuts,
+                       ReportStds,TypePrbs,xInitMean,xInitStd):
+        '''
+        Construct LivPrbArray, TransPrbArray, ReportPrbArray, and HealthInitDstn
+        from model paramaters.
+
+        Parameters
+        ----------
+        age_min : float
+            Minimum value that age takes on in model.
+        age_max : float
+            Maximum value that age takes on in model.
+        age_incr : float
+            Increment for age in the model.
+        Mort0 : float
+            Constant in mortality probit function.
+        MortSex : float
+            Shifter for being male in mortality probit function.
+        MortHealth1 : float
+            Linear coefficient on health in mortality probit function.
+        MortHealth2 : float
+            Quadratic coefficient on health in mortality probit function.
+        MortHealth3 : float
+            Cubic coefficient on health in mortality probit function.
+        MortHealth4 : float
+            Quartic coefficient on health in mortality probit function.
+        MortAge1 : float
+            Linear coefficient on age in mortality probit function.
+        MortAge2 : float
+            Quadratic coefficient on age in mortality probit function.
+        MortAge3 : float
+            Cubic coefficient on age in mortality probit function.
+        MortAge4 : float
+            Quartic coefficient on age in mortality probit function.
+        MortHealthAge : float
+            Interaction term between health and age in mortality probit function.
+        MortSexAge : float
+            Interaction term between health and sex in mortality probit function.
+        Corr0 : float
+            Constant in correlation coefficient function.
+        CorrAge1 : float
+            Linear coefficient on age in correlation coefficient function.
+        CorrAge2 : float
+            Quadratic coefficient on age in correlation coefficient function.
+        CorrAge3 : float
+            Cubic coefficient on age in correlation coefficient function.
+        CorrAge4 : float
+            Quartic coefficient on age in correlation coefficient function.
+        Health0 : float
+            Constant in expected next health function.
+        HealthSex : float
+            Shifter for sex in expected next health function.
+        HealthAge1 : float
+            Linear coefficient in expected next health function.
+        HealthAge2 : float
+            Quadratic coefficient in expected next health function.
+        HealthAge3 : float
+            Cubic coefficient in expected next health function.
+        HealthAge4 : float
+            Quartic coefficient in expected next health function.
+        HealthAgeSex : float
+            Interaction between age and sex in expected next health function.
+        HealthShockAvgs : [float]
+            Vector of health shock means; should have overall mean 0 when weighting by probs.
+        HealthShockStds : [float]
+            Vector of health shock means; should have overall std 1 when weighting by probs.
+        HealthShockPrbs : [float]
+            Vector of weights for the mixed normal health shocks, summing to 1.
+        ReportConstants : [float]
+             List of measure_count - 1 constant terms in report probit equations.
+        ReportCoeffs : [float]
+             List of measure_count linear coefficients on x in report probit equations.
+        ReportCuts : [float]
+            List of report_count-2*measure_count cutoff points in the space of x.
+            The lowest cut point for each measure is assumed to be zero.
+        ReportStds : [float]
+            List of SRHS reporting error standard deviations by type.
+        TypePrbs : [float]
+            Accompanying list of probabilities of each reporting type.
+        xInitMean : float
+            Mean of health at the earliest age in the model.
+        xInitStd : float
+            Standard devation of health at the earliest age in the model.
+
+        Returns
+        -------
+        LivPrbArray : np.array
+            Array of shape (2,age_count,x_count) with survival probabilities.
+        TransPrbArray : np.array
+            Array of shape (2,age_count,x_count,x_count) with transition probabilities
+            between health states at each sex and age.
+        ReportPrbArray : np.array
+            Array of shape (h_count,x_count) with the probability of reporting health
+            status h when the individual's true health is x.
+        InitialHealthDstn : np.array
+            Array of shape (2,age_count,x_count) with the unconditional distribution
+            of continuous health x at age j and sex s.
+        '''
+        with self.profiler.stage('makeLivPrbArray'):
+            LivPrbArray = self.makeLivPrbArray(
+                            age_min,age_max,age_incr,Mort0,MortSex,MortHealth1,MortHealth2,
+                            MortHealth3,MortHealth4,MortAge1,MortAge2,MortAge3,MortAge4,
+                            MortHealthAge,MortSexAge)
+
+        with self.profiler.stage('makeTransProbArray'):
+            TransPrbArray = self.makeTransProbArray(
+                               age_min,age_max,age_incr,Corr0,CorrAge1,CorrAge2,CorrAge3,
+                               CorrAge4,Health0,HealthSex,HealthAge1,HealthAge2,HealthAge3,
+                               HealthAge4,HealthAgeSex,HealthShockAvgs,HealthShockStds,HealthShockPrbs)
+
+        ReportCutLists = []
+        pos = 0
+        for j in range(self.measure_count):
+            c_count = self.category_counts[j] - 2
+            ReportCutLists.append(ReportCuts[pos:(pos+c_count)])
+            pos += c_count
+        with self.profiler.stage('makeReportPrbArray'):
+            ReportPrbArray = self.makeReportPrbArray(ReportConstants,ReportCoeffs,ReportCutLists,ReportStds)
+
+        with self.profiler.stage('makeInitialHealthDstn'):
+            HealthInitDstn = self.makeInitialHealthDstn(LivPrbArray,TransPrbArray,xInitMean,xInitStd,TypePrbs)
+
+        return LivPrbArray, TransPrbArray, ReportPrbArray, HealthInitDstn
+
+
+
+    # Define a function that translates a vector of parameters into a dictionary
+    def makeParameterDict(self, param_vec, return_as_array=False):
+        '''
+        Transforms a vector of size 27 + h_count - 2 into a dictionary.
+
+        Parameters
+        ----------
+        param_vec : np.array
+            Array of model parameters; order is shown in code.
+        return_as_array : bool
+            Indicator for whether this function should return a 1D array of structural
+            parameters rather than a dictionary.
+
+        Returns
+        -------
+        param_dict : dictionary
+            Dictionary that can be used in makeProbArrays.
+        '''
+        # Get parameter indices
+        a = 26 + self.mixed_health_shocks*3
+        constants = self.measure_count - 1
+        coefficients = self.measure_count
+        b = a + self.report_type_count - 1
+        c = b + self.report_type_count - 1
+        d = c + constants
+        e = d + coefficients
+
+        # Rescale coefficients
+        MortHealthTaylor = np.array([0., param_vec[2]*1e-1, param_vec[3]*1e-2, param_vec[4]*1e-3, param_vec[5]*1e-4])
+        MortAgeTaylor = np.array([param_vec[0], param_vec[6]*1e-2, param_vec[7]*1e-4, param_vec[8]*1e-6, param_vec[9]*1e-8])
+        CorrTaylor = np.array([param_vec[12], param_vec[13]*1e-2, param_vec[14]*1e-4, param_vec[15]*1e-6, param_vec[16]*1e-8])
+        HealthAgeTaylor = np.array([param_vec[17], param_vec[19]*1e-1, param_vec[20]*1e-2, param_vec[21]*1e-3, param_vec[22]*1e-4])
+
+        # Transform raw parameters into coefficients
+        MortHealthCoeffs = changeTaylorToPoly(MortHealthTaylor, 0.)
+        MortAgeCoeffs = changeTaylorToPoly(MortAgeTaylor, self.age_min)
+        CorrCoeffs = changeTaylorToPoly(CorrTaylor, self.age_min)
+        HealthAgeCoeffs = changeTaylorToPoly(HealthAgeTaylor, self.age_min)
+
+        if self.mixed_health_shocks:
+            HealthShockAvgs = np.zeros(2)
+            HealthShockStds = np.zeros(2)
+            temp = np.array([0., param_vec[28]])
+            HealthShockPrbs = np.exp(temp)/np.sum(np.exp(temp))
+            HealthShockAvgs[1] = param_vec[26]
+            HealthShockAvgs[0] = -HealthShockPrbs[1]*HealthShockAvgs[1]/HealthShockPrbs[0]
+            HealthShockStds[1] = np.exp(param_vec[27])
+            P = HealthShockPrbs
+            M = HealthShockAvgs
+            S = HealthShockStds
+            HealthShockStds[0] = np.sqrt((1. - P[0]*M[0]**2 - P[1]*(S[1]**2 + M[1]**2))/P[0])
+        else:
+            HealthShockAvgs = np.zeros(1)
+            HealthShockStds = np.ones(1)
+            HealthShockPrbs = np.ones(1)
+
+        # Calculate SRHS reporting type probabilities and standard deviations
+        if self.report_type_count > 1:
+            ExpBase = np.concatenate([[1.], np.exp(param_vec[b:c])])
+            TypePrbs = ExpBase/np.sum(ExpBase)
+            ReportStds_temp = np.exp(param_vec[a:b])
+            ReportVars_temp = ReportStds_temp**2
+            ReportVar_new = (1. - np.dot(ReportVars_temp, TypePrbs[1:]))/TypePrbs[0]
+            ReportStds = np.sqrt(np.concatenate([[ReportVar_new], ReportVars_temp]))
+        else:
+            TypePrbs = np.array([1.])
+            ReportStds = np.array([1.])
+
+        if return_as_array: # This is for standard errors only
+            CumulativeCuts = []
+            CutPoints = param_vec[e:]
+            i = 0
+            for m in range(self.measure_count):
+                C = self.category_counts[m]
+                these_cuts = np.cumsum(CutPoints[i:(i+C-2)])
+                CumulativeCuts += these_cuts.tolist()
+                i += C-2
+
+            param_vec_out = np.concatenate([
+                param_vec[0:2],
+                MortHealthTaylor[1:5],
+                MortAgeTaylor[1:5],
+                [param_vec[10]*1e-4,
+                param_vec[11]*1e-3],
+                CorrTaylor,
+                param_vec[17:19],
+                HealthAgeTaylor[1:5],
+                [param_vec[23]*1e-3],
+                HealthShockAvgs,
+                HealthShockStds,
+                HealthShockPrbs,
+                param_vec[24:26],
+                ReportStds,
+                TypePrbs,
+                np.concatenate(([0.],param_vec[c:d])),
+                param_vec[d:e],
+                CumulativeCuts, # Processed into cut points rather than widths
+            ])
+            return param_vec_out
+
+        param_dict = {
+                'age_min' :       self.age_min,
+                'age_max' :       self.age_max,
+                'age_incr' :      self.age_incr,
+                'Mort0' :         MortAgeCoeffs[0],
+                'MortSex' :       param_vec[1],
+                'MortHealth1' :   MortHealthCoeffs[1],
+                'MortHealth2' :   MortHealthCoeffs[2],
+                'MortHealth3' :   MortHealthCoeffs[3],
+                'MortHealth4' :   MortHealthCoeffs[4],
+                'MortAge1' :      MortAgeCoeffs[1],
+                'MortAge2' :      MortAgeCoeffs[2],
+                'MortAge3' :      MortAgeCoeffs[3],
+                'MortAge4' :      MortAgeCoeffs[4],
+                'MortHealthAge' : param_vec[10]*1e-4,
+                'MortSexAge' :    param_vec[11]*1e-3,
+                'Corr0' :         CorrCoeffs[0],
+                'CorrAge1' :      CorrCoeffs[1],
+                'CorrAge2' :      CorrCoeffs[2],
+                'CorrAge3' :      CorrCoeffs[3],
+                'CorrAge4' :      CorrCoeffs[4],
+                'Health0' :       HealthAgeCoeffs[0],
+                'HealthSex' :     param_vec[18],
+                'HealthAge1' :    HealthAgeCoeffs[1],
+                'HealthAge2' :    HealthAgeCoeffs[2], 
+                'HealthAge3' :    HealthAgeCoeffs[3],
+                'HealthAge4' :    HealthAgeCoeffs[4],
+                'HealthAgeSex' :  param_vec[23]*1e-3,
+                'HealthShockAvgs' : HealthShockAvgs,
+                'HealthShockStds' : HealthShockStds,
+                'HealthShockPrbs' : HealthShockPrbs,
+                'xInitMean' :     param_vec[24],
+                'xInitStd' :      param_vec[25],
+                'ReportStds' :    ReportStds,
+                'TypePrbs' :      TypePrbs,
+                'ReportConstants' : np.concatenate(([0],param_vec[c:d])),
+                'ReportCoeffs' :  param_vec[d:e],
+                'ReportCuts' :    param_vec[e:],
+                }
+
+        return param_dict
+
+
+    def castProbArrays(self, LivPrbArray, TransPrbArray, ReportPrbArray, HealthInitDstn):
+        '''
+        Convert the latent health arrays to the dtype of this instance. Every
+        probability distribution in them is then renormalized, so that it still
+        sums to one within the precision of that dtype.
+
+        Parameters
+        ----------
+        LivPrbArray : np.array
+            Survival probabilities, as made by makeLivPrbArray.
+        TransPrbArray : np.array or [[scipy.sparse.csr_array]]
+            Transition probabilities, as made by makeTransProbArray.
+        ReportPrbArray : np.array
+            SRHS reporting probabilities, as made by makeReportPrbArray.
+        HealthInitDstn : np.array
+            Initial health distributions, as made by makeInitialHealthDstn.
+
+        Returns
+        -------
+        LivPrbArray, TransPrbArray, ReportPrbArray, HealthInitDstn
+            The same arrays in the dtype of this instance.
+        '''
+        dtype = self.dtype
+        if dtype == np.float64: # The arrays are built in float64
+            return LivPrbArray, TransPrbArray, ReportPrbArray, HealthInitDstn
+
+        LivPrbArray = LivPrbArray.astype(dtype)
+        if isinstance(TransPrbArray, np.ndarray):
+            TransPrbArray = TransPrbArray.astype(dtype)
+            TransPrbArray /= np.sum(TransPrbArray, axis=-1, keepdims=True)
+        else:
+            TransPrbArray = [[TransPrbs.astype(dtype) for TransPrbs in TransPrbList] for TransPrbList in TransPrbArray]
+            for TransPrbList in TransPrbArray:
+                for TransPrbs in TransPrbList:
+                    TransPrbs.data /= np.repeat(TransPrbs.sum(axis=1), np.diff(TransPrbs.indptr))
+        ReportPrbArray = ReportPrbArray.astype(dtype)
+        for bot, count in zip(self.measure_starts, self.category_counts): # Each measure's categories sum to one
+            ReportPrbArray[:,bot:(bot+count),:] /= np.sum(ReportPrbArray[:,bot:(bot+count),:], axis=1, keepdims=True)
+        HealthInitDstn = HealthInitDstn.astype(dtype)
+        HealthInitDstn /= np.sum(HealthInitDstn, axis=-1, keepdims=True)
+        return LivPrbArray, TransPrbArray, ReportPrbArray, HealthInitDstn
+
+
+    def makeCacheKey(self, param_dict=None):
+        '''
+        Make a key that identifies the latent health arrays for this instance, for
+        use with a ProbArrayCache. The key is a hash of the structural parameters
+        that the arrays are built from, the settings in the specification file that
+        determine their shape, the discretization, and the code version.
+
+        Parameters
+        ----------
+        param_dict : dict or None
+            Structural parameters made by makeParameterDict that the arrays are
+            built from. If None, they are made from current_param_vec.
         
-    Returns
-    -------
-    ReportPrbArray : np.array
-        Array of shape (type_count,report_count,x_count_cond) with the probability of reporting
-        each categorical answer for each measure when the individual's true health is x.
-    '''
-    ReportPrbArray = np.zeros((report_count,x_count)) + np.nan
-    
-    pos = 0
-    for j in range(measure_count):
-        Const = Constants[j]
-        Coeff = Coeffs[j]
-        CutList = np.cumsum(CutLists[j])
-        c_count = category_counts[j]
-    
-        Cuts_plus = np.concatenate(([-np.inf,0.0],CutList,[np.inf]))
-        Cuts_tiled = np.tile(np.reshape(Cuts_plus,(1,c_count+1)),(x_count_cond,1))
-        y_grid = Const + Coeff*x_grid
-        y_grid_tiled = np.tile(np.reshape(y_grid,(x_count_cond,1)),(1,c_count+1))
-        distance_array = (Cuts_tiled - y_grid_tiled)
+        Returns
+        -------
+        key : str
+            Hexadecimal SHA-256 hash.
+        '''
+        if param_dict is None:
+            param_dict = self.makeParameterDict(self.current_param_vec)
+        settings = [__version__, self.dtype.str, self.measure_count, list(self.category_counts), self.report_type_count,
+                    self.mixed_health_shocks, self.age_min, self.age_max, self.age_incr,
+                    self.x_count_cond, repr(float(self.x_min)), repr(float(self.x_max))]
+        hasher = hashlib.sha256(repr(settings).encode())
+        for name in sorted(param_dict.keys()):
+            hasher.update(name.encode())
+            hasher.update(np.ascontiguousarray(param_dict[name], dtype='<f8').tobytes())
+        return hasher.hexdigest()
+
+
+    def build(self, cache=None, param_dict=None):
+        '''
+        Construct the latent health arrays from the structural parameter vector
+        in the specification file, storing them as attributes of this instance.
+        The arrays are built in float64, then converted to the dtype of this instance.
+        If a cache is passed, arrays already built for the same parameters and
+        discretization are loaded from it (memory-mapped) instead; otherwise the
+        newly built arrays are stored in it.
         
-        if j == 0: # If this measure is SRHS, then use different reporting error std for each type
-            for n in range(report_type_count):
-                distance_array_temp = distance_array / ReportStds[n]
-                CDF_array = norm.cdf(distance_array_temp)
-                ReportPrbArray[pos:(pos+c_count),(n*x_count_cond):((n+1)*x_count_cond)] = np.transpose(CDF_array[:,1:] - CDF_array[:,:-1])
-        else: # For all other measures, use standard normal reporting error
-            CDF_array = norm.cdf(distance_array)
-            ReportPrbArray[pos:(pos+c_count),:] = np.tile(np.transpose(CDF_array[:,1:] - CDF_array[:,:-1]), report_type_count)
+        Parameters
+        ----------
+        cache : ProbArrayCache or None
+            Disk cache of previously built arrays; see LatentHealthCache.py.
+        param_dict : dict or None
+            Structural parameters made by makeParameterDict for this specification,
+            if they have already been made; they do not depend on the discretization.
         
-        pos += c_count
-    
-    # Reshape the reporting probabilities and return it
-    ReportPrbArrayX = np.zeros((report_type_count, report_count, x_count_cond))
-    for k in range(report_type_count):
-        bot = k*x_count_cond
-        top = (k+1)*x_count_cond
-        for h in range(report_count):
-            ReportPrbArrayX[k,h,:] = ReportPrbArray[h,bot:top]
-    return ReportPrbArrayX
-
-
-# Define the function that constructs the distribution of health for individuals
-# when they are first observed in the data
-def makeInitialHealthDstn(LivPrbArray,TransPrbArray,xInitMean,xInitStd,TypePrbs):
+        Returns
+        -------
+        LivPrbArray : np.array
+            Array of shape (2,age_count,x_count) with survival probabilities.
+        TransPrbArray : np.array
+            Array of shape (2,age_count,x_count,x_count) with transition probabilities
+            between health states at each sex and age.
+        ReportPrbArray : np.array
+            Array of shape (type_count,report_count,x_count) with the probability of
+            reporting each SRHS when the individual's true health is x.
+        HealthInitDstn : np.array
+            Array of shape (2,age_count,x_count) with the unconditional distribution
+            of continuous health x at age j and sex s.
+        '''
+        if param_dict is None:
+            param_dict = self.makeParameterDict(self.current_param_vec)
+        self.param_dict = param_dict
+        if (cache is not None) and (self.trans_tol is not None):
+            raise ValueError('Truncated transition matrices cannot be cached; use trans_tol=None.')
+        arrays = None
+        if cache is not None:
+            key = self.makeCacheKey(param_dict)
+            with self.profiler.stage('cache_load'):
+                arrays = cache.load(key)
+        if arrays is None:
+            with self.profiler.stage('makeProbArrays'):
+                arrays = self.castProbArrays(*self.makeProbArrays(**self.param_dict))
+            if cache is not None:
+                with self.profiler.stage('cache_save'):
+                    cache.save(key, arrays)
+        LivPrbArray, TransPrbArray, ReportPrbArray, HealthInitDstn = arrays
+        self.LivPrbArray = LivPrbArray
+        self.TransPrbArray = TransPrbArray
+        self.ReportPrbArray = ReportPrbArray
+        self.HealthInitDstn = HealthInitDstn
+        self.clearPropagators()
+        return LivPrbArray, TransPrbArray, ReportPrbArray, HealthInitDstn
+
+
+    def write_process(self, output_name, file_version=2):
+        '''
+        Write the discretized latent health process to a binary file that can be
+        read by LoadLatentHealthProcess.py. Builds the arrays if necessary.
+
+        Parameters
+        ----------
+        output_name : str
+            The name of the file to which to write the latent health process.
+        file_version : int
+            Version of the file format to write. Version 2 (default) has a header
+            describing the file, as documented in LoadLatentHealthProcess.py. The
+            original version 1 format stores grid sizes in single bytes, and so
+            cannot represent more than 255 nodes or ages. Values are written in the
+            dtype of this instance, which version 1 requires to be float64.
+
+        Returns
+        -------
+        None
+        '''
+        if self.TransPrbArray is None:
+            self.build()
+        x_count_cond = self.x_count_cond
+        age_count_A = self.age_count_A
+        report_count = self.report_count
+        report_type_count = self.report_type_count
+        dtype = self.dtype.newbyteorder('>').str
+
+        if file_version == 1:
+            # Grid sizes are stored in one byte each, and values are always '>f8'
+            if max(x_count_cond, age_count_A, report_count, report_type_count) > 255:
+                raise ValueError('Version 1 process files cannot hold more than 255 nodes or ages; use file_version=2.')
+            if dtype != '>f8':
+                raise ValueError('Version 1 process files can only hold float64 values; use file_version=2.')
+            header = bytes([int(x_count_cond), int(age_count_A), int(report_count), int(report_type_count)])
+        elif file_version == 2:
+            # Find the size of the header, padded so that the arrays are aligned
+            spec_bytes = self.spec_name.encode('utf-8')
+            header_size = 92 + len(spec_bytes)
+            header_size += (-header_size) % 8
+
+            # Find the byte offset of each array in the file
+            section_sizes = [x_count_cond,
+                             2*age_count_A*x_count_cond,
+                             2*age_count_A*x_count_cond**2,
+                             report_type_count*report_count*x_count_cond,
+                             2*age_count_A*x_count_cond]
+            offsets = np.concatenate(([header_size], header_size + np.cumsum(section_sizes[:-1])*np.dtype(dtype).itemsize))
+
+            header = pack('>4sIIIIIII5Q2dI', process_file_magic, process_file_version, header_size,
+                          int(x_count_cond), int(age_count_A), int(report_count), int(report_type_count),
+                          process_dtype_codes[dtype], *[int(offset) for offset in offsets],
+                          self.x_min, self.x_max, len(spec_bytes))
+            header += spec_bytes
+            header += bytes(header_size - len(header))
+        else:
+            raise ValueError('Process file version must be 1 or 2.')
+
+        with self.profiler.stage('write_process'), open(output_name, 'wb') as f:
+
+            # Write the header, with grid sizes, to file
+            f.write(header)
+
+            # Write the latent health grid and survival probabilities to the file
+            f.write(np.asarray(self.x_grid).astype(dtype).tobytes())
+            f.write(self.LivPrbArray.astype(dtype).tobytes())
+
+            # Write transition probabilities to the file, one sex-age block at a time
+            for s in range(2):
+                for j in range(age_count_A):
+                    TransPrbs = self.TransPrbArray[s][j]
+                    if not isinstance(TransPrbs, np.ndarray):
+                        TransPrbs = TransPrbs.toarray()
+                    f.write(TransPrbs.astype(dtype).tobytes())
+
+            # Write SRHS reporting probabilities and initial health distributions to the file
+            f.write(self.ReportPrbArray.astype(dtype).tobytes())
+            f.write(self.HealthInitDstn.astype(dtype).tobytes())
+
+            f.close()
+
+
+    def makeFilterArrays(self):
+        '''
+        Reshape the discretized latent health arrays for filtering, so that the
+        reporting type and latent health node are combined into one dimension of
+        size type_count*x_count. The arrays are stored as attributes of this
+        instance. Builds the arrays if necessary.
+
+        Survival and transitions do not depend on reporting type, so the matrix that
+        advances a distribution over (type, health) is block diagonal. It is never
+        built; the filters instead apply the fused survival and transition matrix
+        for each gap between observations (see getPropagator) to each type's
+        distribution separately. Those matrices are made as needed and cached.
+
+        Returns
+        -------
+        None
+        '''
+        if self.TransPrbArray is None:
+            self.build()
+        x_count_cond = self.x_count_cond
+        x_count = self.x_count
+        report_type_count = self.report_type_count
+
+        with self.profiler.stage('makeFilterArrays'):
+            self.ReportPrbFilter = np.reshape(np.transpose(self.ReportPrbArray, [0,2,1]), (x_count, self.report_count))
+            self.LivPrbFilter = np.tile(self.LivPrbArray, (1,1,report_type_count))
+            self.HealthInitFilter = np.tile(self.HealthInitDstn, (1,1,report_type_count))
+            for k in range(report_type_count):
+                bot = x_count_cond*k
+                top = x_count_cond*(k+1)
+                self.HealthInitFilter[:,:,bot:top] *= self.param_dict['TypePrbs'][k]
+
+
+    def filterSequences(self, s, j, SRHS_array):
+        '''
+        Find the discretized distribution of latent health and reporting type for
+        each of many SRHS sequences, for one sex and current age. Sequences with
+        the same number of leading missing observations start at the same age, so
+        they are stacked into a matrix and advanced together with one matrix product
+        per period. Within each such group, the sequences are treated as a prefix
+        tree: the distribution after each distinct partial history is computed once
+        and shared by every sequence that begins with that history. Requires that
+        makeFilterArrays has been run.
+
+        Because the transitions are applied per type and over whole gaps between
+        waves, the order of floating point operations differs from filtering each
+        sequence with the full transition matrix one period at a time. Results
+        agree with that to rounding error (relative differences up to about 1e-14
+        in double precision), not byte for byte.
+
+        Parameters
+        ----------
+        s : int
+            Sex of the respondent (0 female, 1 male).
+        j : int
+            Index of the respondent's current age.
+        SRHS_array : np.array
+            Array of shape (seq_count,Z) with SRHS sequences, oldest wave first. SRHS
+            takes values 1 to report_count, or -1 for missing.
+
+        Returns
+        -------
+        valid : np.array
+            Boolean array of size seq_count indicating whether each sequence can
+            be observed, i.e. does not use SRHS from before age_min.
+        T_to_sim : np.array
+            Integer array of size seq_count with the number of model periods between
+            the first observed SRHS in each sequence and the current age.
+        p_mat : np.array
+            Array of shape (seq_count,type_count*x_count) with the distribution of
+            reporting type and latent health for each sequence; rows for sequences
+            that are not valid are zeros.
+        '''
+        seq_count, Z = SRHS_array.shape
+        wave_length = self.wave_length
+        ReportPrbArray = np.concatenate((self.ReportPrbFilter, np.ones((self.x_count,1), dtype=self.dtype)), axis=1)
+
+        # Count leading missing SRHS and find the number of periods to simulate
+        observed = SRHS_array != -1
+        missing_to_start = np.where(np.any(observed, axis=1), np.argmax(observed, axis=1), Z)
+        T_to_sim = np.maximum(Z - missing_to_start - 1, 0)*wave_length
+        age = self.age_min + j*self.age_incr
+        valid = (age - T_to_sim*self.age_incr) >= self.age_min
+        p_mat = np.zeros((seq_count, self.x_count), dtype=self.dtype)
+
+        # Advance each group of sequences with the same number of leading missing SRHS together
+        for m in np.unique(missing_to_start[valid]):
+            these = np.logical_and(valid, missing_to_start == m)
+            T_this = T_to_sim[these][0]
+            j0 = j - T_this
+            SRHS_these = SRHS_array[these, m:]
+
+            # Walk down the prefix tree one wave at a time, keeping one row per distinct partial history
+            p_nodes = np.reshape(self.HealthInitFilter[s,j0,:], (1,self.x_count))
+            node_idx = np.zeros(SRHS_these.shape[0], dtype=int)
+            for z in range(Z - m):
+                if z > 0: # Advance each distinct partial history to the next wave
+                    p_nodes = self.applyPropagator(p_nodes, s, j0+(z-1)*wave_length, wave_length)
+                    p_nodes /= np.sum(p_nodes, axis=1, keepdims=True)
+
+                # Find the distinct partial histories through this wave and their parents
+                prefixes = np.concatenate((node_idx[:,np.newaxis], SRHS_these[:,z:(z+1)]), axis=1)
+                prefixes, node_idx = np.unique(prefixes, axis=0, return_inverse=True)
+                node_idx = np.reshape(node_idx, -1)
+                p_nodes = p_nodes[prefixes[:,0], :]
+
+                # Update discrete distributions where SRHS is observed
+                SRHS = prefixes[:,1]
+                report_idx = np.where(SRHS == -1, self.report_count, SRHS - 1)
+                p_nodes *= np.transpose(ReportPrbArray[:, report_idx])
+                p_sums = np.sum(p_nodes, axis=1)
+                p_sums[SRHS == -1] = 1.
+                p_nodes /= p_sums[:,np.newaxis]
+            p_mat[these, :] = p_nodes[node_idx, :]
+
+        return valid, T_to_sim, p_mat
+
+
+    def clearPropagators(self):
+        '''
+        Delete all fused survival and transition matrices made by getPropagator.
+        This is done whenever the arrays are built.
+
+        Returns
+        -------
+        None
+        '''
+        self.propagator_cache = OrderedDict()
+        self.propagator_bytes = 0
+
+
+    def getPropagator(self, s, j, k):
+        '''
+        Get the matrix that applies survival and transitions for k periods starting
+        at one sex and age, which is the product over those periods of each period's
+        survival probabilities (as a diagonal matrix) times its transition matrix.
+        Multiplying a distribution of latent health by it gives the distribution k
+        periods later, scaled by the probability of surviving that long.
+
+        The matrices are made when first needed, by extending the longest one already
+        made for the same sex and age, and are kept in a cache. When the cache holds
+        more than propagator_max_bytes, the least recently used matrices are dropped.
+
+        Parameters
+        ----------
+        s : int
+            Sex (0 female, 1 male).
+        j : int
+            Index of age in the first period.
+        k : int
+            Number of periods to span; j+k must be a valid age index.
+
+        Returns
+        -------
+        Propagator : np.array or scipy.sparse.csr_array
+            Matrix of shape (x_count,x_count), sparse if the transition matrices are.
+        '''
+        key = (int(s), int(j), int(k))
+        if key in self.propagator_cache:
+            self.propagator_cache.move_to_end(key)
+            return self.propagator_cache[key]
+        if not ((0 <= key[0] < 2) and (0 <= key[1]) and (key[2] >= 1) and (key[1] + key[2] < self.age_count_A)):
+            raise IndexError('Propagators must span at least one period and end at an age index less than ' + str(self.age_count_A) + '.')
+
+        # Start from the longest propagator already made for this sex and age
+        Propagator = None
+        k_done = 0
+        for k_prev in range(key[2]-1, 0, -1):
+            if (key[0], key[1], k_prev) in self.propagator_cache:
+                Propagator = self.propagator_cache[(key[0], key[1], k_prev)]
+                k_done = k_prev
+                break
+        for t in range(key[1] + k_done, key[1] + key[2]):
+            LivPrbs = self.LivPrbArray[key[0],t,:self.x_count_cond]
+            TransPrbs = self.TransPrbArray[key[0]][t] # Either a dense or sparse matrix
+            if isinstance(TransPrbs, np.ndarray):
+                Step = LivPrbs[:,np.newaxis]*TransPrbs
+            else:
+                Step = TransPrbs.multiply(LivPrbs[:,np.newaxis]).tocsr()
+            Propagator = Step if Propagator is None else Propagator @ Step
+        self.profiler.count('propagators_made')
+
+        # Store the new propagator, dropping the least recently used ones if necessary
+        if isinstance(Propagator, np.ndarray):
+            nbytes = Propagator.nbytes
+        else:
+            nbytes = Propagator.data.nbytes + Propagator.indices.nbytes + Propagator.indptr.nbytes
+        self.propagator_cache[key] = Propagator
+        self.propagator_bytes += nbytes
+        while (self.propagator_bytes > self.propagator_max_bytes) and (len(self.propagator_cache) > 1):
+            old_key, Old = self.propagator_cache.popitem(last=False)
+            if isinstance(Old, np.ndarray):
+                self.propagator_bytes -= Old.nbytes
+            else:
+                self.propagator_bytes -= Old.data.nbytes + Old.indices.nbytes + Old.indptr.nbytes
+        return Propagator
+
+
+    def applyPropagator(self, p_mat, s, j, k):
+        '''
+        Apply survival and transitions for k periods to distributions over reporting
+        type and latent health, with one matrix product; see getPropagator. The
+        result is not renormalized, so each row sums to the probability of surviving
+        the k periods, given the distribution.
+
+        Parameters
+        ----------
+        p_mat : np.array
+            Array of shape (dstn_count,type_count*x_count) with distributions of
+            reporting type and latent health.
+        s : int
+            Sex of the respondent (0 female, 1 male).
+        j : int
+            Index of the respondent's age in the first period.
+        k : int
+            Number of periods to advance.
+
+        Returns
+        -------
+        p_next : np.array
+            Array of shape (dstn_count,type_count*x_count) with the distributions
+            of reporting type and latent health k periods later, times survival.
+        '''
+        p_by_type = np.reshape(p_mat, (p_mat.shape[0]*self.report_type_count, self.x_count_cond))
+        p_next = p_by_type @ self.getPropagator(s, j, k)
+        self.profiler.count('propagator_matmuls')
+        self.profiler.count('propagator_matvecs', p_by_type.shape[0])
+        return np.reshape(p_next, p_mat.shape)
+
+
+    def summarizeFilterDstns(self, p_mat):
+        '''
+        Calculate reporting type probabilities and moments of latent health from
+        discretized distributions of reporting type and latent health.
+
+        Parameters
+        ----------
+        p_mat : np.array
+            Array of shape (seq_count,type_count*x_count) with distributions of
+            reporting type and latent health, as made by filterSequences.
+
+        Returns
+        -------
+        TypePrbs : np.array
+            Array of shape (seq_count,type_count) with reporting type probabilities.
+        HealthMoments : np.array
+            Array of shape (seq_count,4) with the mean, standard deviation, skewness,
+            and kurtosis of latent health.
+        '''
+        x_grid = self.x_grid
+        p_mat = np.asarray(p_mat, dtype=float) # Summarize in float64 even when filtering in float32
+        p_array = np.reshape(p_mat, (p_mat.shape[0], self.report_type_count, self.x_count_cond))
+        HealthDstn = np.sum(p_array, axis=1)
+        TypePrbs = np.sum(p_array, axis=2)
+
+        HealthMoments = np.zeros((p_mat.shape[0], 4))
+        HealthMean = np.dot(HealthDstn, x_grid)
+        HealthDev = x_grid - HealthMean[:,np.newaxis]
+        HealthStdev = np.sqrt(np.sum(HealthDev**2*HealthDstn, axis=1))
+        HealthDevNorm = HealthDev/HealthStdev[:,np.newaxis]
+        HealthMoments[:,0] = HealthMean
+        HealthMoments[:,1] = HealthStdev
+        HealthMoments[:,2] = np.sum(HealthDevNorm**3*HealthDstn, axis=1)
+        HealthMoments[:,3] = np.sum(HealthDevNorm**4*HealthDstn, axis=1)
+        return TypePrbs, HealthMoments
+
+
+    def makeSRHSSequences(self, Z_to_cond):
+        '''
+        Make all permutations of SRHS histories of length Z_to_cond, in order.
+
+        Parameters
+        ----------
+        Z_to_cond : int
+            The number of survey waves in each history.
+
+        Returns
+        -------
+        SRHS_array : np.array
+            Integer array of shape ((report_count+1)**Z_to_cond,Z_to_cond) with each
+            SRHS history, oldest wave first; missing SRHS are -1.
+        '''
+        SRHS_list = [-1] + list(np.arange(1,self.report_count+1).astype(int))
+        SRHS_listX = Z_to_cond*[SRHS_list]
+        SRHS_array = np.array(list(itertools.product(*SRHS_listX)), dtype=int)
+        return SRHS_array
+
+
+    def filterBlock(self, s, j, SRHS_array):
+        '''
+        Make summary statistics for the distribution of latent health (and reporting
+        type) conditional on each of many SRHS sequences, for one sex and current
+        age. Sequences that use SRHS from before age_min are skipped. Requires that
+        makeFilterArrays has been run.
+
+        Parameters
+        ----------
+        s : int
+            Sex of the respondent (0 female, 1 male).
+        j : int
+            Index of the respondent's current age.
+        SRHS_array : np.array
+            Array of shape (seq_count,Z) with SRHS sequences, oldest wave first.
+
+        Returns
+        -------
+        ages : np.array
+            Array of size row_count with the current age of each row.
+        SRHS_valid : np.array
+            Integer array of shape (row_count,Z) with the SRHS sequence for each row.
+        TypePrbs : np.array
+            Array of shape (row_count,type_count) with reporting type probabilities.
+        HealthMoments : np.array
+            Array of shape (row_count,4) with the mean, standard deviation, skewness,
+            and kurtosis of latent health.
+        '''
+        age_incr = self.age_incr
+
+        # Generate discretized distributions of latent health conditional on each observed sequence
+        with self.profiler.stage('filterSequences'):
+            valid, T_to_sim, p_mat = self.filterSequences(s, j, SRHS_array)
+        with self.profiler.stage('summarizeFilterDstns'):
+            TypePrbs, HealthMoments = self.summarizeFilterDstns(p_mat[valid,:])
+        self.profiler.count('sequences_processed', np.sum(valid))
+        self.profiler.count('sequences_skipped_age', valid.size - np.sum(valid))
+        ages = np.full(np.sum(valid), np.arange(self.age_min, self.age_max + age_incr, age_incr)[j])
+        return ages, SRHS_array[valid,:], TypePrbs, HealthMoments
+
+
+    def filterBlocks(self, Z_to_cond, workers=1):
+        '''
+        Generate summary statistics for the distribution of latent health (and
+        reporting type) conditional on every possible sequence of SRHS in up to
+        Z_to_cond survey waves, one block for each sex and current age in turn.
+        Only one block is held in memory at a time. Builds the arrays if necessary.
+
+        With more than one worker, the sex-age blocks are divided among a pool of
+        processes. The arrays that define the latent health process are put in
+        shared memory once, rather than copied to each process, and blocks are
+        still generated in the same order as with one worker.
+
+        Parameters
+        ----------
+        Z_to_cond : int
+            The number of survey waves on which to condition latent health.
+        workers : int
+            Number of processes to use.
+
+        Yields
+        ------
+        s : int
+            Sex of the respondents in this block (0 female, 1 male).
+        ages : np.array
+            Array of size row_count with the current age of each row.
+        SRHS_array : np.array
+            Integer array of shape (row_count,Z_to_cond) with the SRHS sequence for
+            each row, oldest wave first; missing SRHS are -1.
+        TypePrbs : np.array
+            Array of shape (row_count,type_count) with reporting type probabilities.
+        HealthMoments : np.array
+            Array of shape (row_count,4) with the mean, standard deviation, skewness,
+            and kurtosis of latent health.
+        '''
+        if self.TransPrbArray is None:
+            self.build()
+        blocks = [(s, j) for s in range(2) for j in range(self.age_count_A)]
+
+        if workers <= 1:
+            self.makeFilterArrays()
+            SRHS_array = self.makeSRHSSequences(Z_to_cond)
+            for s, j in blocks:
+                yield (s,) + self.filterBlock(s, j, SRHS_array)
+            return
+
+        # Put the arrays in shared memory, and give the workers a copy of this model without them
+        from multiprocessing.shared_memory import SharedMemory
+        shared_blocks = []
+        shared_arrays = {}
+        WorkerModel = copy(self)
+        WorkerModel.clearPropagators()
+        try:
+            for name in shared_array_names:
+                array = getattr(self, name)
+                if not isinstance(array, np.ndarray): # Sparse transitions are small enough to copy
+                    continue
+                shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+                shared_blocks.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                shared_arrays[name] = (shm.name, array.shape, array.dtype.str)
+                setattr(WorkerModel, name, None)
+
+            with Pool(workers, initializer=initFilterWorker, initargs=(WorkerModel, shared_arrays, Z_to_cond)) as pool:
+                for s, (block, report) in zip([s for s, j in blocks], pool.imap(runFilterWorker, blocks)):
+                    if report is not None:
+                        self.profiler.merge(report)
+                    yield (s,) + block
+        finally:
+            for shm in shared_blocks:
+                shm.close()
+                shm.unlink()
+
+
+    def filterPanel(self, panel, SRHS_cols=None):
+        '''
+        Find the distribution of latent health (and reporting type) for each
+        observation in panel data, conditional on that observation's sex, current
+        age, and observed SRHS history. Unlike the filter method, this only does
+        work for the histories that actually appear in the data: each distinct
+        history is filtered once, and the results are aligned to the input rows.
+
+        Parameters
+        ----------
+        panel : np.array or pandas.DataFrame
+            Array of shape (obs_count,2+Z) with columns for sex (0 female, 1 male),
+            age (in years), and then SRHS from the oldest to the current wave, with
+            -1 for missing SRHS. A DataFrame must have columns named sex and age.
+        SRHS_cols : [str] or None
+            Names of the SRHS columns of a DataFrame, from oldest to current wave.
+            If None, all columns other than sex and age are used, in order.
+
+        Returns
+        -------
+        TypePrbs : np.array
+            Array of shape (obs_count,type_count) with reporting type probabilities.
+        HealthMoments : np.array
+            Array of shape (obs_count,4) with the mean, standard deviation, skewness,
+            and kurtosis of latent health.
+
+        Rows for observations whose age is not in the model, or whose SRHS history
+        reaches back before age_min, are filled with NaN.
+        '''
+        if hasattr(panel, 'columns'): # Take columns by name from a DataFrame
+            if SRHS_cols is None:
+                SRHS_cols = [col for col in panel.columns if col not in ['sex', 'age']]
+            panel = np.asarray(panel[['sex', 'age'] + list(SRHS_cols)], dtype=float)
+        else:
+            panel = np.asarray(panel, dtype=float)
+        obs_count = panel.shape[0]
+        self.makeFilterArrays()
+
+        # Find the age index of each observation, and which observations are in the model
+        sex = panel[:,0].astype(int)
+        age_idx = np.round((panel[:,1] - self.age_min)/self.age_incr).astype(int)
+        SRHS_array = panel[:,2:].astype(int)
+        in_model = np.logical_and(np.logical_or(sex == 0, sex == 1), np.logical_and(age_idx >= 0, age_idx < self.age_count_A))
+        in_model = np.logical_and(in_model, np.all(np.logical_or(SRHS_array == -1, np.logical_and(SRHS_array >= 1, SRHS_array <= self.report_count)), axis=1))
+
+        # Find each distinct sex-age-history and which observations have it
+        keys = np.concatenate((sex[:,np.newaxis], age_idx[:,np.newaxis], SRHS_array), axis=1)[in_model,:]
+        unique_keys, key_idx = np.unique(keys, axis=0, return_inverse=True)
+        key_idx = np.reshape(key_idx, -1)
+
+        # Filter the distinct histories for each sex and age together
+        TypePrbsUnique = np.full((unique_keys.shape[0], self.report_type_count), np.nan)
+        HealthMomentsUnique = np.full((unique_keys.shape[0], 4), np.nan)
+        sex_age_keys, sex_age_idx = np.unique(unique_keys[:,:2], axis=0, return_inverse=True)
+        sex_age_idx = np.reshape(sex_age_idx, -1)
+        for i in range(sex_age_keys.shape[0]):
+            s, j = sex_age_keys[i]
+            these = np.flatnonzero(sex_age_idx == i)
+            valid, T_to_sim, p_mat = self.filterSequences(s, j, unique_keys[these,2:])
+            if np.any(valid):
+                TypePrbs, HealthMoments = self.summarizeFilterDstns(p_mat[valid,:])
+                TypePrbsUnique[these[valid],:] = TypePrbs
+                HealthMomentsUnique[these[valid],:] = HealthMoments
+
+        # Align the results with the input rows
+        TypePrbsOut = np.full((obs_count, self.report_type_count), np.nan)
+        HealthMomentsOut = np.full((obs_count, 4), np.nan)
+        TypePrbsOut[in_model,:] = TypePrbsUnique[key_idx,:]
+        HealthMomentsOut[in_model,:] = HealthMomentsUnique[key_idx,:]
+        return TypePrbsOut, HealthMomentsOut
+
+
+    def forwardFilter(self, sex, age, SRHS_array):
+        '''
+        Run a forward filter over the full SRHS histories of many respondents at
+        once, finding the distribution of latent health (and reporting type) at each
+        period when SRHS is observed, conditional on all SRHS observed up to then.
+        Each respondent starts from the distribution of latent health at their first
+        age, and periods without an observed SRHS only apply survival and transitions.
+        Respondents are advanced from each observed period straight to their next one
+        with a single fused matrix (see getPropagator), and respondents of the same
+        sex, current age, and gap between observations are advanced together with one
+        matrix product, so the cost is linear in the size of the panel.
+
+        Parameters
+        ----------
+        sex : np.array
+            Array of size resp_count with each respondent's sex (0 female, 1 male).
+        age : np.array
+            Array of size resp_count with each respondent's age in the first period.
+        SRHS_array : np.array
+            Array of shape (resp_count,T) with each respondent's SRHS in each model
+            period, starting with the first. Any value other than 1 to report_count
+            (such as -1 or NaN) is treated as missing.
+
+        Returns
+        -------
+        TypePrbs : np.array
+            Array of shape (resp_count,T,type_count) with reporting type probabilities
+            in each period when SRHS is observed, and NaN otherwise.
+        HealthMoments : np.array
+            Array of shape (resp_count,T,4) with the mean, standard deviation, skewness,
+            and kurtosis of latent health in each period when SRHS is observed, and
+            NaN otherwise.
+        '''
+        self.makeFilterArrays()
+        SRHS_array = np.array(SRHS_array, dtype=float)
+        resp_count, T = SRHS_array.shape
+        sex = np.asarray(sex).astype(int)
+        j0 = np.round((np.asarray(age, dtype=float) - self.age_min)/self.age_incr).astype(int)
+        in_model = np.logical_and(np.logical_or(sex == 0, sex == 1), np.logical_and(j0 >= 0, j0 < self.age_count_A))
+        SRHS_array[np.logical_not(np.isin(SRHS_array, np.arange(1,self.report_count+1)))] = 0.
+        SRHS_idx = SRHS_array.astype(int) - 1
+
+        # Find the next period after each period in which each respondent's SRHS is observed,
+        # which is T if there is none; SRHS observed beyond the oldest age is ignored
+        observed = np.logical_and(SRHS_idx >= 0, in_model[:,np.newaxis])
+        observed = np.logical_and(observed, (j0[:,np.newaxis] + np.arange(T)) < self.age_count_A)
+        next_obs = np.full((resp_count, T), T, dtype=int)
+        for t in range(T-2, -1, -1):
+            next_obs[:,t] = np.where(observed[:,t+1], t+1, next_obs[:,t+1])
+
+        TypePrbs = np.full((resp_count, T, self.report_type_count), np.nan)
+        HealthMoments = np.full((resp_count, T, 4), np.nan)
+        p_mat = np.zeros((resp_count, self.x_count), dtype=self.dtype)
+        p_mat[in_model,:] = self.HealthInitFilter[sex[in_model], j0[in_model], :]
+
+        for t in range(T):
+            j = j0 + t
+            obs = np.flatnonzero(observed[:,t])
+            if obs.size > 0: # Update and summarize discrete distributions where SRHS is observed
+                p_obs = p_mat[obs,:]*np.transpose(self.ReportPrbFilter[:, SRHS_idx[obs,t]])
+                p_obs /= np.sum(p_obs, axis=1, keepdims=True)
+                p_mat[obs,:] = p_obs
+                TypePrbs[obs,t,:], HealthMoments[obs,t,:] = self.summarizeFilterDstns(p_obs)
+
+            # Advance respondents who are observed (or start) now and are observed again
+            # straight to their next observed period, grouped by sex, current age, and gap
+            advance = np.flatnonzero(np.logical_and(np.logical_or(observed[:,t], t == 0), next_obs[:,t] < T))
+            if advance.size == 0:
+                continue
+            gaps = next_obs[advance,t] - t
+            gap_keys, gap_idx = np.unique(np.stack((sex[advance], j[advance], gaps), axis=1), axis=0, return_inverse=True)
+            gap_idx = np.reshape(gap_idx, -1)
+            for i in range(gap_keys.shape[0]):
+                s_now, j_now, k = gap_keys[i]
+                these = advance[gap_idx == i]
+                p_these = self.applyPropagator(p_mat[these,:], s_now, j_now, k) # Apply survival and transitions
+                p_these /= np.sum(p_these, axis=1, keepdims=True)
+                p_mat[these,:] = p_these
+
+        return TypePrbs, HealthMoments
+
+
+    def forwardFilterFile(self, output_name, data_file=None, delimiter=None, chunk_size=10000):
+        '''
+        Run a forward filter over every respondent's full SRHS history in a panel
+        data file, writing a tab-delimited text file with one row for each wave in
+        which a respondent's SRHS is observed. The data file is read, filtered, and
+        written in chunks of respondents, in a single pass.
+
+        The data file should have one row per respondent, with columns as described
+        by the data settings in the specification file: sex_col (male dummy), age_col
+        (age in the first period), weight_col, id_col (if not None), and SRHS in each
+        of T_max model periods starting at data_init_col, with measure_count columns
+        per period. Column numbers count from zero.
+
+        Parameters
+        ----------
+        output_name : str
+            The name of the file to which to write the filtered distributions.
+        data_file : str or None
+            Name of the panel data file. If None, data_file from the specification is used.
+        delimiter : str or None
+            Delimiter between columns in the data file; None means any whitespace.
+        chunk_size : int
+            Number of respondents to filter at once.
+
+        Returns
+        -------
+        None
+        '''
+        if data_file is None:
+            data_file = self.data_file
+        SRHS_cols = self.data_init_col + self.measure_count*np.arange(self.T_max)
+        names = ['id', 'weight', 'sex', 'age', 'SRHS']
+        names += ['typeprob' + str(k+1) for k in range(self.report_type_count)]
+        names += ['healthmean', 'healthstdev', 'healthskew', 'healthkurt']
+
+        with open(data_file, 'r') as data, open(output_name, 'w') as f:
+            f.write('\t'.join(names) + '\n')
+            resp_done = 0
+            while True:
+                lines = list(itertools.islice(data, chunk_size))
+                if len(lines) == 0:
+                    break
+                panel = np.loadtxt(lines, delimiter=delimiter, ndmin=2)
+                ids = panel[:,self.id_col].astype(np.int64) if self.id_col is not None else np.arange(resp_done, resp_done + panel.shape[0])
+                resp_done += panel.shape[0]
+                sex = panel[:,self.sex_col]
+                age = panel[:,self.age_col]
+                SRHS_array = panel[:,SRHS_cols]
+                TypePrbs, HealthMoments = self.forwardFilter(sex, age, SRHS_array)
+
+                # Make a tab-delimited entry for each observed wave of each respondent
+                resp_idx, t_idx = np.nonzero(np.logical_not(np.isnan(HealthMoments[:,:,0])))
+                rows = zip(ids[resp_idx].tolist(), panel[resp_idx,self.weight_col].tolist(),
+                           sex[resp_idx].astype(int).tolist(), (age[resp_idx] + t_idx*self.age_incr).tolist(),
+                           SRHS_array[resp_idx,t_idx].astype(int).tolist(),
+                           TypePrbs[resp_idx,t_idx,:].tolist(), HealthMoments[resp_idx,t_idx,:].tolist())
+                out_lines = ['\t'.join(map(str, [resp_id, weight, s, a, SRHS] + type_prbs + moments)) + '\n'
+                             for resp_id, weight, s, a, SRHS, type_prbs, moments in rows]
+                f.write(''.join(out_lines))
+            f.close()
+
+
+    def loadPanelData(self, data_file=None, delimiter=None):
+        '''
+        Load a panel data file for likelihood evaluation. The data file should have
+        the layout described in forwardFilterFile. Respondents whose sex or age in
+        the first period is not in the model are dropped.
+
+        Parameters
+        ----------
+        data_file : str or None
+            Name of the panel data file. If None, data_file from the specification is used.
+        delimiter : str or None
+            Delimiter between columns in the data file; None means any whitespace.
+
+        Returns
+        -------
+        panel : dict
+            Dictionary with arrays of each respondent's weight, sex, and index of
+            age in the first period (j0), and an array of shape (resp_count,T_max,
+            measure_count) with reports of each measure in each period ('reports').
+        '''
+        if data_file is None:
+            data_file = self.data_file
+        data = np.loadtxt(data_file, delimiter=delimiter, ndmin=2)
+        sex = data[:,self.sex_col].astype(int)
+        j0 = np.round((data[:,self.age_col] - self.age_min)/self.age_incr).astype(int)
+        keep = np.logical_and(np.logical_or(sex == 0, sex == 1), np.logical_and(j0 >= 0, j0 < self.age_count_A))
+        report_cols = self.data_init_col + np.arange(self.T_max*self.measure_count)
+        reports = np.reshape(data[keep][:,report_cols], (np.sum(keep), self.T_max, self.measure_count))
+
+        panel = {
+            'weight' : data[keep,self.weight_col],
+            'sex' : sex[keep],
+            'j0' : j0[keep],
+            'reports' : reports,
+            }
+        return panel
+
+
+    def panelLogLikelihood(self, param_vec=None, panel=None):
+        '''
+        Calculate the weighted log likelihood of the reports in panel data. Each
+        respondent's likelihood is the probability of their observed reports, and
+        of surviving from their first period to the last period with a report,
+        conditional on sex and age in the first period. Periods with no report,
+        including those between survey waves, add no information beyond survival.
+
+        The forward algorithm is run for all respondents at once, with one row
+        per respondent of a matrix over reporting type and latent health. Reports
+        are applied to all rows by broadcasting. Survival and transitions from each
+        period with a report to the next are applied with a single fused matrix (see
+        getPropagator), to each group of respondents with the same sex, current age,
+        and gap between reports with one matrix product. Each row is rescaled to sum
+        to one after each step, and the log scale factors are summed.
+
+        Parameters
+        ----------
+        param_vec : np.array or None
+            Structural parameter vector at which to evaluate the likelihood; if
+            given, it becomes current_param_vec and the arrays are rebuilt with it.
+        panel : dict or None
+            Panel data made by loadPanelData. If None, the data file named in the
+            specification is loaded the first time and kept as panel_data.
+
+        Returns
+        -------
+        LogLike : float
+            Sum of the weighted log likelihoods of all respondents.
+        '''
+        if param_vec is not None:
+            self.current_param_vec = np.array(param_vec, dtype=float)
+            self.build()
+        elif self.TransPrbArray is None:
+            self.build()
+        if panel is None:
+            if getattr(self, 'panel_data', None) is None:
+                self.panel_data = self.loadPanelData()
+            panel = self.panel_data
+        self.makeFilterArrays()
+        self.likelihood_eval_count += 1
+        self.profiler.count('likelihood_evals')
+
+        sex = panel['sex']
+        j0 = panel['j0']
+        reports = panel['reports']
+        resp_count, T, measure_count = reports.shape
+
+        # Find the index of each observed report in ReportPrbFilter, or -1 if it is missing
+        category_counts = np.reshape(np.asarray(self.category_counts), (1,1,measure_count))
+        measure_starts = np.reshape(self.measure_starts, (1,1,measure_count))
+        observed = np.logical_and(np.isin(reports, np.arange(1,np.max(category_counts)+1)), reports <= category_counts)
+        report_idx = np.where(observed, measure_starts + np.nan_to_num(reports).astype(int) - 1, -1)
+
+        # Find the next period after each period with any report (before the oldest age)
+        # for each respondent, which is T if there is none
+        observed = np.logical_and(np.any(observed, axis=2), (j0[:,np.newaxis] + np.arange(T)) < self.age_count_A)
+        next_obs = np.full((resp_count, T), T, dtype=int)
+        for t in range(T-2, -1, -1):
+            next_obs[:,t] = np.where(observed[:,t+1], t+1, next_obs[:,t+1])
+
+        p_mat = self.HealthInitFilter[sex, j0, :]
+        LogLikes = np.zeros(resp_count)
+        for t in range(T):
+            # Apply the probability of each observed report, rescaling the rows
+            active = np.flatnonzero(observed[:,t])
+            for m in range(measure_count):
+                these = active[report_idx[active,t,m] >= 0]
+                p_mat[these,:] *= np.transpose(self.ReportPrbFilter[:, report_idx[these,t,m]])
+            p_sums = np.sum(p_mat[active,:], axis=1)
+            LogLikes[active] += np.log(p_sums)
+            p_mat[active,:] /= p_sums[:,np.newaxis]
+
+            # Apply survival and transitions up to the next report to respondents who
+            # are observed (or start) now, grouped by sex, current age, and gap, rescaling
+            # the rows by the probability of surviving to the next report
+            advance = np.flatnonzero(np.logical_and(np.logical_or(observed[:,t], t == 0), next_obs[:,t] < T))
+            if advance.size == 0:
+                continue
+            gaps = next_obs[advance,t] - t
+            gap_keys, gap_idx = np.unique(np.stack((sex[advance], j0[advance] + t, gaps), axis=1), axis=0, return_inverse=True)
+            gap_idx = np.reshape(gap_idx, -1)
+            for i in range(gap_keys.shape[0]):
+                s, j, k = gap_keys[i]
+                these = advance[gap_idx == i]
+                p_these = self.applyPropagator(p_mat[these,:], s, j, k)
+                p_sums = np.sum(p_these, axis=1)
+                LogLikes[these] += np.log(p_sums)
+                p_mat[these,:] = p_these/p_sums[:,np.newaxis]
+
+        LogLike = np.dot(panel['weight'], LogLikes)
+        return LogLike
+
+
+    def negLogLikelihood(self, sub_param_vec):
+        '''
+        Objective function for estimating the parameters in which_indices from the
+        specification file, holding the others at their values in current_param_vec.
+        It can be passed to a minimizer such as scipy.optimize.minimize.
+
+        Parameters
+        ----------
+        sub_param_vec : np.array
+            Values of the parameters in which_indices.
+
+        Returns
+        -------
+        NegLogLike : float
+            Negative of the weighted log likelihood of the panel data.
+        '''
+        param_vec = np.array(self.current_param_vec, dtype=float)
+        param_vec[self.which_indices] = sub_param_vec
+        return -self.panelLogLikelihood(param_vec)
+
+
+    def makeFilterColumnNames(self, Z_to_cond):
+        '''
+        Make the list of column names for filter output, in order.
+
+        Parameters
+        ----------
+        Z_to_cond : int
+            The number of survey waves on which to condition latent health.
+
+        Returns
+        -------
+        names : [str]
+            Names of the columns: sex, age, SRHS from oldest to current wave, the
+            probability of each reporting type, and moments of latent health.
+        '''
+        names = ['sex', 'age']
+        names += ['SRHStm' + str(z) for z in range(Z_to_cond-1,0,-1)] + ['SRHSt']
+        names += ['typeprob' + str(k+1) for k in range(self.report_type_count)]
+        names += ['healthmean', 'healthstdev', 'healthskew', 'healthkurt']
+        return names
+
+
+    def filter(self, output_name, Z_to_cond, output_format=None, workers=1):
+        '''
+        Write a file with summary statistics for the distribution of latent health
+        (and reporting type) conditional on sex, current age, and every possible
+        sequence of SRHS in up to Z_to_cond survey waves. Builds the arrays if necessary.
+
+        The default output is a tab-delimited text file. Its rows are written one
+        sex-age block at a time as they are made, so memory use does not grow with
+        the size of the file. The same columns can instead be written as typed
+        arrays: an uncompressed numpy .npz file, or a Parquet or Feather file (these
+        two require the pyarrow package). Parquet and Feather files are also written
+        one block at a time, while an .npz file is assembled in memory.
+
+        Parameters
+        ----------
+        output_name : str
+            The name of the file to which to write the conditional distributions.
+        Z_to_cond : int
+            The number of survey waves on which to condition latent health.
+        output_format : str or None
+            One of 'txt', 'npz', 'parquet', or 'feather'. If None, the format is
+            chosen by the extension of output_name, with 'txt' for any unknown one.
+        workers : int
+            Number of processes to use; see filterBlocks.
+
+        Returns
+        -------
+        None
+        '''
+        T = Z_to_cond # Rename
+        if output_format is None:
+            extension = os.path.splitext(output_name)[1].lower()
+            output_format = {'.npz' : 'npz', '.parquet' : 'parquet', '.feather' : 'feather'}.get(extension, 'txt')
+        if output_format not in ['txt', 'npz', 'parquet', 'feather']:
+            raise ValueError('Filter output format must be "txt", "npz", "parquet", or "feather".')
+        names = self.makeFilterColumnNames(T)
+
+        if output_format == 'txt':
+            with open(output_name, 'w') as f:
+                f.write('\t'.join(names) + '\n')
+
+                # Make a tab-delimited entry for each sex-age-sequence, writing each block as it is made
+                for s, ages, SRHS_array, TypePrbs, HealthMoments in self.filterBlocks(T, workers):
+                    with self.profiler.stage('write_output'):
+                        rows = zip(ages.tolist(), SRHS_array.tolist(), TypePrbs.tolist(), HealthMoments.tolist())
+                        lines = [str(s) + '\t' + str(age) + '\t' + '\t'.join(map(str, seq + type_prbs + moments)) + '\n'
+                                 for age, seq, type_prbs, moments in rows]
+                        f.write(''.join(lines))
+                f.close()
+            return
+
+        # Make typed columns for each sex-age block
+        def makeColumns(s, ages, SRHS_array, TypePrbs, HealthMoments):
+            arrays = [np.full(ages.size, s, dtype=np.int8), ages]
+            arrays += [SRHS_array[:,z].astype(np.int8) for z in range(T)]
+            arrays += [TypePrbs[:,k] for k in range(self.report_type_count)]
+            arrays += [HealthMoments[:,i] for i in range(4)]
+            return arrays
+
+        if output_format == 'npz':
+            blocks = [makeColumns(*block) for block in self.filterBlocks(T, workers)]
+            columns = {names[i] : np.concatenate([block[i] for block in blocks]) for i in range(len(names))}
+            with self.profiler.stage('write_output'), open(output_name, 'wb') as f: # np.savez would add .npz to other names
+                np.savez(f, **columns)
+                f.close()
+            return
+
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Writing filter output as ' + output_format + ' requires the pyarrow package.')
+        writer = None
+        try:
+            for block in self.filterBlocks(T, workers):
+                with self.profiler.stage('write_output'):
+                    batch = pyarrow.RecordBatch.from_arrays(makeColumns(*block), names=names)
+                    if writer is None:
+                        if output_format == 'parquet':
+                            writer = pyarrow.parquet.ParquetWriter(output_name, batch.schema)
+                        else:
+                            writer = pyarrow.ipc.new_file(output_name, batch.schema)
+                    if output_format == 'parquet':
+                        writer.write_table(pyarrow.Table.from_batches([batch]))
+                    else:
+                        writer.write_batch(batch)
+        finally: # Close the file even if filtering or writing a block fails
+            if writer is not None:
+                writer.close()
+
+
+    def describe(self):
+        '''
+        Print a description of the specification and discretization to screen.
+        
+        Returns
+        -------
+        None
+        '''
+        print('The process is based on the parameters in the specification called ' + self.spec_name + '.')
+        print('It discretizes latent health with ' + str(self.x_count_cond) + ' nodes equally spaced between ' + str(self.x_min) + ' and ' + str(self.x_max) + '.')
+        print('There are ' + str(self.age_count_A) + ' ages from ' + str(self.age_min) + ' to ' + str(self.age_max) + ' and ' + str(self.report_type_count) + ' reporting types.')
+        for k in range(self.report_type_count):
+            this_line = 'Reporting type ' + str(k+1) + ' ('
+            this_line += "{:.2%}".format(self.param_dict['TypePrbs'][k])
+            this_line += ') has a reporting error standard deviation of '
+            this_line += mystr(self.param_dict['ReportStds'][k]) + '.'
+            print(this_line)
+        if self.truncation_report is not None:
+            print('Transition probabilities below ' + str(self.trans_tol) + ' were dropped, keeping ' + "{:.2%}".format(self.truncation_report['nonzero_share'])
+                  + ' of entries; each row changed by at most ' + "{:.3g}".format(self.truncation_report['max_row_error']) + ' in L1 distance.')
+
+
+# Model and SRHS sequences used by each worker process in a parallel filter
+worker_model = None
+worker_SRHS_array = None
+worker_shared_blocks = []
+
+def initFilterWorker(WorkerModel, shared_arrays, Z_to_cond):
     '''
-    Make an array with the unconditional distribution of the continuous health
-    state x for someone who has been observed for the first time.
-    
+    Set up a worker process for a parallel filter, attaching to the arrays that
+    define the latent health process in shared memory.
+
     Parameters
     ----------
-    LivPrbArray : np.array
-        Survival probabilities at each sex, age, and health state.
-    TransPrbArray : np.array
-        Transitions probabilities at each sex, age, and health state combination.
-    xInitMean : float
-        Mean of health at the earliest age in the model.
-    xInitStd : float
-        Standard devation of health at the earliest age in the model.
-    TypePrbs : np.array
-        Array of population shares of each reporting type (should sum to 1).
-        
+    WorkerModel : LatentHealthModel
+        Copy of the latent health model, without its large arrays.
+    shared_arrays : dict
+        Dictionary with the shared memory name, shape, and dtype of each array.
+    Z_to_cond : int
+        The number of survey waves on which to condition latent health.
+
     Returns
     -------
-    InitialHealthDstn : np.array
-        Array of shape (2,age_count,x_count) with the unconditional distribution
-        of continuous health x at age j and sex s.
+    None
     '''
-    T = LivPrbArray.shape[1]
-    InitialHealthDstn = np.zeros((2,T,x_count_cond))
-    
-    # Approximate the distribution of health at the earliest age in the model
-    distances = (x_cuts - xInitMean)/xInitStd
-    distances[0] = -20.
-    distances[-1] = 20.
-    CDFs = norm.cdf(distances)
-    prob_base = CDFs[1:] - CDFs[:-1]
-    HealthDstn0 = prob_base/np.sum(prob_base)
-    
-    # Loop over the two sexes
-    for s in range(2):
-        HealthDstnNow = HealthDstn0.copy()
-        for j in range(T):
-            InitialHealthDstn[s,j,:] = HealthDstnNow
-            LivPrbs = LivPrbArray[s,j,:x_count_cond]
-            TempDstn = HealthDstnNow*LivPrbs
-            HealthDstnNow = TempDstn/np.sum(TempDstn)
-            TransPrbs = TransPrbArray[s,j,:x_count_cond,:x_count_cond]
-            HealthDstnNow = np.dot(np.transpose(TransPrbs),HealthDstnNow)
-            
-    return InitialHealthDstn
-    
+    from multiprocessing.shared_memory import SharedMemory
+    global worker_model, worker_SRHS_array
+    WorkerModel.profiler = StageProfiler(WorkerModel.profiler.enabled, WorkerModel.profiler.trace_memory)
+    for name, (shm_name, shape, dtype) in shared_arrays.items():
+        shm = SharedMemory(name=shm_name)
+        worker_shared_blocks.append(shm)
+        setattr(WorkerModel, name, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    WorkerModel.makeFilterArrays()
+    worker_model = WorkerModel
+    worker_SRHS_array = WorkerModel.makeSRHSSequences(Z_to_cond)
 
-# Define the function that constructs arrays for the LL evaluation
-def makeProbArrays(age_min,age_max,age_incr,Mort0,MortSex,MortHealth1,MortHealth2,
-                   MortHealth3,MortHealth4,MortAge1,MortAge2,MortAge3,MortAge4,
-                   MortHealthAge,MortSexAge,Corr0,CorrAge1,CorrAge2,CorrAge3,
-                   CorrAge4,Health0,HealthSex,HealthAge1,HealthAge2,HealthAge3,
-                   HealthAge4,HealthAgeSex,HealthShockAvgs,HealthShockStds,
-                   HealthShockPrbs,ReportConstants,ReportCoeffs,ReportCuts,
-                   ReportStds,TypePrbs,xInitMean,xInitStd):
+
+def runFilterWorker(block):
     '''
-    Construct LivPrbArray, TransPrbArray, ReportPrbArray, and HealthInitDstn
-    from model paramaters.
-    
+    Make one sex-age block of filter output in a worker process.
+
     Parameters
     ----------
-    age_min : float
-        Minimum value that age takes on in model.
-    age_max : float
-        Maximum value that age takes on in model.
-    age_incr : float
-        Increment for age in the model.
-    Mort0 : float
-        Constant in mortality probit function.
-    MortSex : float
-        Shifter for being male in mortality probit function.
-    MortHealth1 : float
-        Linear coefficient on health in mortality probit function.
-    MortHealth2 : float
-        Quadratic coefficient on health in mortality probit function.
-    MortHealth3 : float
-        Cubic coefficient on health in mortality probit function.
-    MortHealth4 : float
-        Quartic coefficient on health in mortality probit function.
-    MortAge1 : float
-        Linear coefficient on age in mortality probit function.
-    MortAge2 : float
-        Quadratic coefficient on age in mortality probit function.
-    MortAge3 : float
-        Cubic coefficient on age in mortality probit function.
-    MortAge4 : float
-        Quartic coefficient on age in mortality probit function.
-    MortHealthAge : float
-        Interaction term between health and age in mortality probit function.
-    MortSexAge : float
-        Interaction term between health and sex in mortality probit function.
-    Corr0 : float
-        Constant in correlation coefficient function.
-    CorrAge1 : float
-        Linear coefficient on age in correlation coefficient function.
-    CorrAge2 : float
-        Quadratic coefficient on age in correlation coefficient function.
-    CorrAge3 : float
-        Cubic coefficient on age in correlation coefficient function.
-    CorrAge4 : float
-        Quartic coefficient on age in correlation coefficient function.
-    Health0 : float
-        Constant in expected next health function.
-    HealthSex : float
-        Shifter for sex in expected next health function.
-    HealthAge1 : float
-        Linear coefficient in expected next health function.
-    HealthAge2 : float
-        Quadratic coefficient in expected next health function.
-    HealthAge3 : float
-        Cubic coefficient in expected next health function.
-    HealthAge4 : float
-        Quartic coefficient in expected next health function.
-    HealthAgeSex : float
-        Interaction between age and sex in expected next health function.
-    HealthShockAvgs : [float]
-        Vector of health shock means; should have overall mean 0 when weighting by probs.
-    HealthShockStds : [float]
-        Vector of health shock means; should have overall std 1 when weighting by probs.
-    HealthShockPrbs : [float]
-        Vector of weights for the mixed normal health shocks, summing to 1.
-    ReportConstants : [float]
-         List of measure_count - 1 constant terms in report probit equations.
-    ReportCoeffs : [float]
-         List of measure_count linear coefficients on x in report probit equations.
-    ReportCuts : [float]
-        List of report_count-2*measure_count cutoff points in the space of x.
-        The lowest cut point for each measure is assumed to be zero.
-    ReportStds : [float]
-        List of SRHS reporting error standard deviations by type.
-    TypePrbs : [float]
-        Accompanying list of probabilities of each reporting type.
-    xInitMean : float
-        Mean of health at the earliest age in the model.
-    xInitStd : float
-        Standard devation of health at the earliest age in the model.
-        
+    block : (int, int)
+        Sex and current age index of the block.
+
     Returns
     -------
-    LivPrbArray : np.array
-        Array of shape (2,age_count,x_count) with survival probabilities.
-    TransPrbArray : np.array
-        Array of shape (2,age_count,x_count,x_count) with transition probabilities
-        between health states at each sex and age.
-    ReportPrbArray : np.array
-        Array of shape (h_count,x_count) with the probability of reporting health
-        status h when the individual's true health is x.
-    InitialHealthDstn : np.array
-        Array of shape (2,age_count,x_count) with the unconditional distribution
-        of continuous health x at age j and sex s.
+    results : tuple
+        Output of LatentHealthModel.filterBlock for this block.
+    report : dict or None
+        Report of the worker's profiler since its last block, or None if it is
+        disabled. A worker's first report includes the stages run by initFilterWorker.
     '''
-    LivPrbArray = makeLivPrbArray(
-                    age_min,age_max,age_incr,Mort0,MortSex,MortHealth1,MortHealth2,
-                    MortHealth3,MortHealth4,MortAge1,MortAge2,MortAge3,MortAge4,
-                    MortHealthAge,MortSexAge)
-    
-    TransPrbArray = makeTransProbArray(
-                       age_min,age_max,age_incr,Corr0,CorrAge1,CorrAge2,CorrAge3,
-                       CorrAge4,Health0,HealthSex,HealthAge1,HealthAge2,HealthAge3,
-                       HealthAge4,HealthAgeSex,HealthShockAvgs,HealthShockStds,HealthShockPrbs)
-    
-    ReportCutLists = []
-    pos = 0
-    for j in range(measure_count):
-        c_count = category_counts[j] - 2
-        ReportCutLists.append(ReportCuts[pos:(pos+c_count)])
-        pos += c_count
-    ReportPrbArray = makeReportPrbArray(ReportConstants,ReportCoeffs,ReportCutLists,ReportStds)
-    
-    HealthInitDstn = makeInitialHealthDstn(LivPrbArray,TransPrbArray,xInitMean,xInitStd,TypePrbs)
-    
-    return LivPrbArray, TransPrbArray, ReportPrbArray, HealthInitDstn
-
+    s, j = block
+    profiler = worker_model.profiler
+    results = worker_model.filterBlock(s, j, worker_SRHS_array)
+    report = profiler.report() if profiler.enabled else None
+    profiler.reset() # Each stage is only reported once
+    return results, report
 
 
-# Define a function that translates a vector of parameters into a dictionary
-def makeParameterDict(param_vec, return_as_array=False):
+def main(my_args):
     '''
-    Transforms a vector of size 27 + h_count - 2 into a dictionary.
+    Run this script from the command line; see documentation at the top of this file.
     
     Parameters
     ----------
-    param_vec : np.array
-        Array of model parameters; order is shown in code.
-    return_as_array : bool
-        Indicator for whether this function should return a 1D array of structural
-        parameters rather than a dictionary.
+    my_args : [str]
+        List of command line arguments, as in sys.argv.
         
     Returns
     -------
-    param_dict : dictionary
-        Dictionary that can be used in makeProbArrays.
+    None
     '''
-    # Get parameter indices
-    a = 26 + mixed_health_shocks*3
-    constants = measure_count - 1
-    coefficients = measure_count
-    b = a + report_type_count - 1
-    c = b + report_type_count - 1
-    d = c + constants
-    e = d + coefficients
-    
-    # Rescale coefficients
-    MortHealthTaylor = np.array([0., param_vec[2]*1e-1, param_vec[3]*1e-2, param_vec[4]*1e-3, param_vec[5]*1e-4])
-    MortAgeTaylor = np.array([param_vec[0], param_vec[6]*1e-2, param_vec[7]*1e-4, param_vec[8]*1e-6, param_vec[9]*1e-8])
-    CorrTaylor = np.array([param_vec[12], param_vec[13]*1e-2, param_vec[14]*1e-4, param_vec[15]*1e-6, param_vec[16]*1e-8])
-    HealthAgeTaylor = np.array([param_vec[17], param_vec[19]*1e-1, param_vec[20]*1e-2, param_vec[21]*1e-3, param_vec[22]*1e-4])
-    
-    # Transform raw parameters into coefficients
-    MortHealthCoeffs = changeTaylorToPoly(MortHealthTaylor, 0.)
-    MortAgeCoeffs = changeTaylorToPoly(MortAgeTaylor, age_min)
-    CorrCoeffs = changeTaylorToPoly(CorrTaylor, age_min)
-    HealthAgeCoeffs = changeTaylorToPoly(HealthAgeTaylor, age_min)
-    
-    if mixed_health_shocks:
-        HealthShockAvgs = np.zeros(2)
-        HealthShockStds = np.zeros(2)
-        temp = np.array([0., param_vec[28]])
-        HealthShockPrbs = np.exp(temp)/np.sum(np.exp(temp))
-        HealthShockAvgs[1] = param_vec[26]
-        HealthShockAvgs[0] = -HealthShockPrbs[1]*HealthShockAvgs[1]/HealthShockPrbs[0]
-        HealthShockStds[1] = np.exp(param_vec[27])
-        P = HealthShockPrbs
-        M = HealthShockAvgs
-        S = HealthShockStds
-        HealthShockStds[0] = np.sqrt((1. - P[0]*M[0]**2 - P[1]*(S[1]**2 + M[1]**2))/P[0])
-    else:
-        HealthShockAvgs = np.zeros(1)
-        HealthShockStds = np.ones(1)
-        HealthShockPrbs = np.ones(1)
-    
-    # Calculate SRHS reporting type probabilities and standard deviations
-    if report_type_count > 1:
-        ExpBase = np.concatenate([[1.], np.exp(param_vec[b:c])])
-        TypePrbs = ExpBase/np.sum(ExpBase)
-        ReportStds_temp = np.exp(param_vec[a:b])
-        ReportVars_temp = ReportStds_temp**2
-        ReportVar_new = (1. - np.dot(ReportVars_temp, TypePrbs[1:]))/TypePrbs[0]
-        ReportStds = np.sqrt(np.concatenate([[ReportVar_new], ReportVars_temp]))
-    else:
-        TypePrbs = np.array([1.])
-        ReportStds = np.array([1.])
-    
-    if return_as_array: # This is for standard errors only
-        CumulativeCuts = []
-        CutPoints = param_vec[e:]
-        i = 0
-        for m in range(measure_count):
-            C = category_counts[m]
-            these_cuts = np.cumsum(CutPoints[i:(i+C-2)])
-            CumulativeCuts += these_cuts.tolist()
-            i += C-2
-    
-        param_vec_out = np.concatenate([
-            param_vec[0:2],
-            MortHealthTaylor[1:5],
-            MortAgeTaylor[1:5],
-            [param_vec[10]*1e-4,
-            param_vec[11]*1e-3],
-            CorrTaylor,
-            param_vec[17:19],
-            HealthAgeTaylor[1:5],
-            [param_vec[23]*1e-3],
-            HealthShockAvgs,
-            HealthShockStds,
-            HealthShockPrbs,
-            param_vec[24:26],
-            ReportStds,
-            TypePrbs,
-            np.concatenate(([0.],param_vec[c:d])),
-            param_vec[d:e],
-            CumulativeCuts, # Processed into cut points rather than widths
-        ])
-        return param_vec_out
-    
-    param_dict = {
-            'age_min' :       age_min,
-            'age_max' :       age_max,
-            'age_incr' :      age_incr,
-            'Mort0' :         MortAgeCoeffs[0],
-            'MortSex' :       param_vec[1],
-            'MortHealth1' :   MortHealthCoeffs[1],
-            'MortHealth2' :   MortHealthCoeffs[2],
-            'MortHealth3' :   MortHealthCoeffs[3],
-            'MortHealth4' :   MortHealthCoeffs[4],
-            'MortAge1' :      MortAgeCoeffs[1],
-            'MortAge2' :      MortAgeCoeffs[2],
-            'MortAge3' :      MortAgeCoeffs[3],
-            'MortAge4' :      MortAgeCoeffs[4],
-            'MortHealthAge' : param_vec[10]*1e-4,
-            'MortSexAge' :    param_vec[11]*1e-3,
-            'Corr0' :         CorrCoeffs[0],
-            'CorrAge1' :      CorrCoeffs[1],
-            'CorrAge2' :      CorrCoeffs[2],
-            'CorrAge3' :      CorrCoeffs[3],
-            'CorrAge4' :      CorrCoeffs[4],
-            'Health0' :       HealthAgeCoeffs[0],
-            'HealthSex' :     param_vec[18],
-            'HealthAge1' :    HealthAgeCoeffs[1],
-            'HealthAge2' :    HealthAgeCoeffs[2], 
-            'HealthAge3' :    HealthAgeCoeffs[3],
-            'HealthAge4' :    HealthAgeCoeffs[4],
-            'HealthAgeSex' :  param_vec[23]*1e-3,
-            'HealthShockAvgs' : HealthShockAvgs,
-            'HealthShockStds' : HealthShockStds,
-            'HealthShockPrbs' : HealthShockPrbs,
-            'xInitMean' :     param_vec[24],
-            'xInitStd' :      param_vec[25],
-            'ReportStds' :    ReportStds,
-            'TypePrbs' :      TypePrbs,
-            'ReportConstants' : np.concatenate(([0],param_vec[c:d])),
-            'ReportCoeffs' :  param_vec[d:e],
-            'ReportCuts' :    param_vec[e:],
-            }
-    
-    return param_dict
+    # Take the number of worker processes from the optional --workers argument
+    workers = 1
+    if '--workers' in my_args:
+        i = my_args.index('--workers')
+        workers = int(my_args[i+1])
+        my_args = my_args[:i] + my_args[(i+2):]
 
+    # Record the time and memory used by each stage of work if the optional
+    # --profile argument is given, also tracing allocations with --trace-memory
+    profile_name = None
+    trace_memory = '--trace-memory' in my_args
+    if trace_memory:
+        my_args = [arg for arg in my_args if arg != '--trace-memory']
+    if '--profile' in my_args:
+        i = my_args.index('--profile')
+        profile_name = my_args[i+1]
+        my_args = my_args[:i] + my_args[(i+2):]
 
-# Construct latent health arrays from the structural parameter vector
-my_dict = makeParameterDict(current_param_vec)
-LivPrbArray, TransPrbArray, ReportPrbArray, HealthInitDstn = makeProbArrays(**my_dict)
+    # Use single precision if the optional --dtype argument is given
+    dtype = 'float64'
+    if '--dtype' in my_args:
+        i = my_args.index('--dtype')
+        dtype = my_args[i+1]
+        my_args = my_args[:i] + my_args[(i+2):]
 
-if worktype == 'process':
-    # Write the arrays to disk so that they can be imported in other work
-    t0 = time()
-    with open(output_name, 'wb') as f:
-        
-        # Write grid sizes to file
-        f.write(int(x_count_cond).to_bytes(1, 'big'))
-        f.write(int(age_count_A).to_bytes(1, 'big'))
-        f.write(int(report_count).to_bytes(1, 'big'))
-        f.write((report_type_count).to_bytes(1, 'big'))
-        
-        # Write the latent health grid to the file
-        for h in range(x_count_cond):
-            f.write(pack('>d', x_grid[h]))
-            
-        # Write survival probabilities to the file
-        for s in range(2):
-            for j in range(age_count_A):
-                for h in range(x_count_cond):
-                    f.write(pack('>d', LivPrbArray[s,j,h]))
-                    
-        # Write transition probabilities to the file
-        for s in range(2):
-            for j in range(age_count_A):
-                for i in range(x_count_cond):
-                    for h in range(x_count_cond):
-                        f.write(pack('>d', TransPrbArray[s,j,i,h]))
-                        
-        # Write SRHS reporting probabilities to the file
-        for k in range(report_type_count):
-            for x in range(report_count):
-                for h in range(x_count_cond):
-                    f.write(pack('>d', ReportPrbArray[k,x,h]))
-                    
-        # Write initial health distributions to the file
-        for s in range(2):
-            for j in range(age_count_A):
-                for h in range(x_count_cond):
-                    f.write(pack('>d', HealthInitDstn[s,j,h]))
-        
-        f.close()
-    t1 = time()
-    
-    # Describe the specification used, printing to screen
-    print('Wrote discretized latent health process to ' + output_name + ' in ' + mystr(t1-t0) + ' seconds.')
-    print('The process is based on the parameters in the specification called ' + spec_name + '.')
-    print('It discretizes latent health with ' + str(x_count_cond) + ' nodes equally spaced between ' + str(x_min) + ' and ' + str(x_max) + '.')
-    print('There are ' + str(age_count_A) + ' ages from ' + str(age_min) + ' to ' + str(age_max) + ' and ' + str(report_type_count) + ' reporting types.')
-    for k in range(report_type_count):
-        this_line = 'Reporting type ' + str(k+1) + ' ('
-        this_line += "{:.2%}".format(my_dict['TypePrbs'][k])
-        this_line += ') has a reporting error standard deviation of '
-        this_line += mystr(my_dict['ReportStds'][k]) + '.'
-        print(this_line)
-
-
-if worktype == 'filter':
-    t0 = time()
-    T = Z_to_cond # Rename
-    
-    # Reshape discretized latent health arrays
-    ReportPrbArray = np.reshape(np.transpose(ReportPrbArray, [0,2,1]), (x_count_cond*report_type_count, report_count))
-    LivPrbArray = np.tile(LivPrbArray, (1,1,report_type_count))
-    HealthInitDstn = np.tile(HealthInitDstn, (1,1,report_type_count))
-    for k in range(report_type_count):
-        bot = x_count_cond*k
-        top = x_count_cond*(k+1)
-        HealthInitDstn[:,:,bot:top] *= my_dict['TypePrbs'][k]
-    TransPrbArray_big = np.zeros((2,age_count_A,x_count,x_count))
-    for n in range(report_type_count):
-        TransPrbArray_big[:,:,(n*x_count_cond):((n+1)*x_count_cond),(n*x_count_cond):((n+1)*x_count_cond)] = TransPrbArray
-    TransPrbArray = TransPrbArray_big
-    
-    # Make all permutations of a SRHS histories of length T
-    SRHS_list = [-1] + list(np.arange(1,report_count+1).astype(int))
-    SRHS_listX = T*[SRHS_list]
-    SRHS_sequences = list(itertools.product(*SRHS_listX))
+    # Drop small transition probabilities if the optional --trans-tol argument is given
+    trans_tol = None
+    if '--trans-tol' in my_args:
+        i = my_args.index('--trans-tol')
+        trans_tol = float(my_args[i+1])
+        my_args = my_args[:i] + my_args[(i+2):]
+
+    # Use a disk cache of built arrays if the optional --cache argument is given
+    cache = None
+    if '--cache' in my_args:
+        i = my_args.index('--cache')
+        cache = ProbArrayCache(my_args[i+1])
+        my_args = my_args[:i] + my_args[(i+2):]
+
+    # Process required arguments
+    if len(my_args) < 4:
+        print('Please read the documentation at the top of MakeLatentHealthFile.py to use this file.')
+        return
+    worktype = my_args[1]
+    spec_name = my_args[2]
+    output_name = my_args[3]
+    if not ((worktype == 'filter') or (worktype == 'process')):
+        print('First passed argument should be "filter" or "process"; please read the documentation at the top of MakeLatentHealthFile.py.')
+        print('Code will not produce any output file.')
+        return
     
-    # Make a list of all ages in the data
-    age_list = list(np.arange(age_min, age_max + age_incr, age_incr))
+    # Account for optional parameters
+    node_count = int(my_args[4]) if len(my_args) > 4 else None
+    health_min = float(my_args[5]) if len(my_args) > 5 else None
+    health_max = float(my_args[6]) if len(my_args) > 6 else None
     
-    # Loop through each sex, age, and sequence of SRHS
-    output = 'sex\tage\t'
-    temp = 'SRHSt\t'
-    for z in range(T-1):
-        temp = 'SRHStm' + str(z+1) + '\t' + temp
-    output += temp
-    for k in range(report_type_count):
-        output += 'typeprob' + str(k+1) + '\t'
-    output += 'healthmean\thealthstdev\thealthskew\thealthkurt\n'
+    # Construct latent health arrays from the structural parameter vector
+    MyModel = LatentHealthModel(spec_name, node_count, health_min, health_max, trans_tol, dtype)
+    if profile_name is not None:
+        MyModel.profiler = StageProfiler(enabled=True, trace_memory=trace_memory)
+    with MyModel.profiler.stage('build'):
+        MyModel.build(cache)
     
-    for s in range(2):
-        for j in range(age_count_A):
-            for l in range(len(SRHS_sequences)):
-                seq = SRHS_sequences[l]
-                j0 = j
-                
-                # Adjust initial age for missing
-                age = age_list[j]
-                missing_to_start = 0
-                t = 0
-                while (t < T and seq[t] == -1):
-                    missing_to_start += 1
-                    t += 1
-                Z = T - missing_to_start
-                if Z > 1:
-                    T_to_sim = (Z-1)*wave_length
-                    age -= T_to_sim*age_incr
-                    j0 -= T_to_sim
-                else:
-                    T_to_sim = 0
-                
-                if age < age_min:
-                    continue # Can't do this sequence, uses SRHS from before age_min
-                    
-                # Generate a discretized distribution of latent health conditional on initial age and observed sequence
-                p_vec = HealthInitDstn[s,j0,:].copy()
-                t_to_next_wave = 0
-                z = missing_to_start
-                for t in range(T_to_sim+1):
-                    if (t_to_next_wave == 0):
-                        try:
-                            SRHS = seq[z]
-                        except:
-                            SRHS = -1
-                        if SRHS != -1: # Update discrete distribution if SRHS is observed
-                            SRHS -= 1
-                            p_vec *= ReportPrbArray[:, SRHS]
-                            p_vec /= np.sum(p_vec)
-                        z += 1
-                        t_to_next_wave = wave_length
-                    if t < (T_to_sim):
-                        p_vec *= LivPrbArray[s,j0+t,:] # Apply survival
-                        p_vec /= np.sum(p_vec)
-                        p_vec = np.dot(np.transpose(TransPrbArray[s,j0+t,:,:]), p_vec) # Apply transitions
-                        p_vec /= np.sum(p_vec)
-                    t_to_next_wave -= 1
-                age += T_to_sim*age_incr # Advance age from the "simulation"
-                
-                # Reshape the discretization and produce a latent health dstn and type probs
-                p_array = np.reshape(p_vec, (report_type_count, x_count_cond))
-                HealthDstn = np.sum(p_array, axis=0)
-                TypePrbs = np.sum(p_array, axis=1)
-                
-                # Make a tab-delimited entry for this sex-age-sequence
-                HealthMean = np.dot(x_grid, HealthDstn)
-                HealthStdev = np.sqrt(np.dot((x_grid - HealthMean)**2, HealthDstn))
-                HealthSkew = np.dot(((x_grid - HealthMean)/HealthStdev)**3, HealthDstn)
-                HealthKurt = np.dot(((x_grid - HealthMean)/HealthStdev)**4, HealthDstn)
-                this_line = str(s) + '\t' + str(age) + '\t'
-                for z in range(T):
-                    this_line += str(seq[z]) + '\t'
-                for k in range(report_type_count):
-                    this_line += str(TypePrbs[k]) + '\t'
-                this_line += str(HealthMean) + '\t' + str(HealthStdev) + '\t' + str(HealthSkew) + '\t' + str(HealthKurt)
-                
-                # Add this line to the output string
-                output += this_line + '\n'
+    if worktype == 'process':
+        # Write the arrays to disk so that they can be imported in other work
+        t0 = time()
+        MyModel.write_process(output_name)
+        t1 = time()
+        
+        # Describe the specification used, printing to screen
+        print('Wrote discretized latent health process to ' + output_name + ' in ' + mystr(t1-t0) + ' seconds.')
+        MyModel.describe()
     
-    # Write the output to disk
-    with open(output_name, 'w') as f:
-        f.write(output)
-        f.close()
-    t1 = time()
+    if worktype == 'filter':
+        Z_to_cond = int(my_args[7])
+        t0 = time()
+        with MyModel.profiler.stage('filter'):
+            MyModel.filter(output_name, Z_to_cond, workers=workers)
+        t1 = time()
         
-    # Describe the specification used, printing to screen
-    print('Wrote conditional distributions of latent health to ' + output_name + ' in ' + mystr(t1-t0) + ' seconds.')
-    print('Latent health is conditioned on up to ' + str(T) + ' observations of SRHS from the ' + source_name + '.')
-    print('The process is based on the parameters in the specification called ' + spec_name + '.')
-    print('It discretizes latent health with ' + str(x_count_cond) + ' nodes equally spaced between ' + str(x_min) + ' and ' + str(x_max) + '.')
-    print('There are ' + str(age_count_A) + ' ages from ' + str(age_min) + ' to ' + str(age_max) + ' and ' + str(report_type_count) + ' reporting types.')
-    for k in range(report_type_count):
-        this_line = 'Reporting type ' + str(k+1) + ' ('
-        this_line += "{:.2%}".format(my_dict['TypePrbs'][k])
-        this_line += ') has a reporting error standard deviation of '
-        this_line += mystr(my_dict['ReportStds'][k]) + '.'
-        print(this_line)
-                
-                
\ No newline at end of file
+        # Describe the specification used, printing to screen
+        print('Wrote conditional distributions of latent health to ' + output_name + ' in ' + mystr(t1-t0) + ' seconds.')
+        print('Latent health is conditioned on up to ' + str(Z_to_cond) + ' observations of SRHS from the ' + MyModel.source_name + '.')
+        MyModel.describe()
+
+    if profile_name is not None:
+        MyModel.profiler.write(profile_name)
+        print('Wrote timing and memory report to ' + profile_name + '.')
+
+
+if __name__ == '__main__':
+    # Get system arguments
+    my_args = sys.argv
+    #my_args = [None, 'process', 'TwoStudyAllOver23HeteroParams', 'MainResults.dat', '40', '-6', '22']
+    #my_args = [None, 'process', 'TwoStudyAllTinyParams', 'TinyResults.dat', '15', '-6', '22']
+    #my_args = [None, 'filter', 'TwoStudyAllOver23HeteroParams', 'ConditionalHealthDstn.txt', '120', '-12', '28', '3']
+    main(my_args)
@@ -0,0 +1,336 @@
+'''
+This file simulates synthetic panel data from a discretized latent health process,
+for stress-testing the filter and models that use its output at production scale.
+Each simulated respondent has a sex, an age in the first period, a reporting type,
+and a latent health node in each period while alive, with survival and SRHS
+reports drawn from the model's probability arrays. It can be run from a command
+line using:
+
+> python SimulateLatentHealth.py spec_name output_name resp_count [node_count health_min health_max] [--seed N] [--chunk-size N] [--truth TRUTH_NAME]
+
+spec_name   : The name of the specification, with no .py file extension.
+output_name : The name of the panel data file to write.
+resp_count  : The number of respondents to simulate.
+node_count, health_min, health_max : The discretization to use; if omitted, the
+              discretization in the specification is used.
+--seed       : Seed for the random number generator; the default is zero.
+--chunk-size : Number of respondents simulated and written at once; the default is 100000.
+--truth      : Name of a second file to which to write each respondent's reporting
+               type and latent health node in each period.
+
+The --cache, --trans-tol, and --dtype options of MakeLatentHealthFile.py can also
+be given, and are used to build the model's arrays.
+
+The panel data file has the layout described by the data settings in the specification
+(id_col, weight_col, sex_col, age_col, and T_max periods of SRHS starting at data_init_col),
+so it can be read directly by LatentHealthModel.forwardFilterFile and loadPanelData. SRHS
+is reported every wave_length periods, starting in the first; all other periods, and all
+periods after death, are written as -1. Every respondent has a weight of one. The truth
+file has one row per respondent with the id, reporting type (counting from one), and
+latent health node (counting from zero, -1 if dead) in each of T_max periods.
+
+Each period is simulated for all living respondents at once. Draws from the discrete
+distributions of initial health, next period's health, and SRHS are made with one
+search of the cumulative probabilities for all respondents; see PanelSimulator.
+The same seed, chunk size, and arrays always make the same panel.
+'''
+from time import time
+import sys
+import numpy as np
+from MakeLatentHealthFile import LatentHealthModel, mystr
+from LatentHealthCache import ProbArrayCache
+
+
+def makeCumulativeRows(PrbMatrix):
+    '''
+    Make a flat array of cumulative probabilities for drawing from each row of a
+    matrix of probabilities. Each row's cumulative probabilities run from zero to
+    one, and the row's index is added to them, so that the rows form a single
+    sorted array; a draw from row r is the first entry above r + u, where u is a
+    uniform draw. This lets one np.searchsorted draw from many different rows.
+
+    Parameters
+    ----------
+    PrbMatrix : np.array or scipy.sparse.csr_array
+        Matrix of shape (row_count,col_count) whose rows are probability distributions.
+
+    Returns
+    -------
+    CumPrbs : np.array
+        Flat array with row index plus cumulative probability of each entry.
+    RowEnds : np.array
+        Array of size row_count with the position in CumPrbs of the last entry of each row.
+    Cols : np.array or None
+        Array with the column of each entry in CumPrbs, or None if the matrix is
+        dense and every row has col_count entries.
+    '''
+    row_count, col_count = PrbMatrix.shape
+    if isinstance(PrbMatrix, np.ndarray):
+        CumPrbs = np.cumsum(PrbMatrix, axis=1, dtype=float)
+        CumPrbs /= CumPrbs[:,-1:]
+        CumPrbs[:,-1] = 1.
+        CumPrbs += np.arange(row_count)[:,np.newaxis]
+        RowEnds = col_count*np.arange(1, row_count+1) - 1
+        return np.reshape(CumPrbs, -1), RowEnds, None
+
+    # For a sparse matrix, only the stored entries can be drawn
+    entry_counts = np.diff(PrbMatrix.indptr)
+    CumAll = np.cumsum(PrbMatrix.data, dtype=float)
+    RowStarts = np.concatenate(([0.], CumAll))[PrbMatrix.indptr[:-1]]
+    RowEnds = PrbMatrix.indptr[1:] - 1
+    CumPrbs = CumAll - np.repeat(RowStarts, entry_counts)
+    CumPrbs /= np.repeat(CumPrbs[RowEnds], entry_counts)
+    CumPrbs[RowEnds] = 1.
+    CumPrbs += np.repeat(np.arange(row_count), entry_counts)
+    return CumPrbs, RowEnds, PrbMatrix.indices.copy()
+
+
+def drawFromRows(CumRows, rows, RNG):
+    '''
+    Draw one column from each of many rows of a probability matrix at once.
+
+    Parameters
+    ----------
+    CumRows : (np.array, np.array, np.array or None)
+        Cumulative probabilities made by makeCumulativeRows.
+    rows : np.array
+        Integer array with the row of the matrix to draw from for each draw.
+    RNG : np.random.Generator
+        Random number generator.
+
+    Returns
+    -------
+    draws : np.array
+        Integer array of the same size as rows with the column drawn for each.
+    '''
+    CumPrbs, RowEnds, Cols = CumRows
+    targets = rows + RNG.random(rows.size)
+    order = np.argsort(targets) # Searching for sorted values is much faster for a large array
+    pos = np.empty(rows.size, dtype=int)
+    pos[order] = np.searchsorted(CumPrbs, targets[order], side='right')
+    pos = np.minimum(pos, RowEnds[rows]) # Guard against rounding of rows + u up to the next row
+    if Cols is None:
+        return pos - (RowEnds[rows] - RowEnds[0])
+    return Cols[pos]
+
+
+class PanelSimulator(object):
+    '''
+    A simulator of panel data from a latent health model. The cumulative probabilities
+    for every draw are made once when the simulator is made, then any number of
+    respondents can be simulated in chunks.
+
+    Parameters
+    ----------
+    MyModel : LatentHealthModel
+        A latent health model; its arrays are built if they have not been already.
+    seed : int
+        Seed for the random number generator.
+    age_dstn : np.array or None
+        Array of size age_count with the probability of each age in the first period.
+        If None, every age from age_min to age_max is equally likely.
+    male_share : float or None
+        Probability that a respondent is male. If None, it is 0.5 if the specification
+        includes both sexes, and otherwise the one sex in sex_list is used.
+    '''
+    def __init__(self, MyModel, seed=0, age_dstn=None, male_share=None):
+        if MyModel.TransPrbArray is None:
+            MyModel.build()
+        self.model = MyModel
+        self.RNG = np.random.default_rng(seed)
+        A = MyModel.age_count_A
+        N = MyModel.x_count_cond
+
+        if age_dstn is None:
+            age_dstn = np.ones(A)/A
+        self.AgeCum = makeCumulativeRows(np.reshape(np.asarray(age_dstn, dtype=float), (1,A)))
+        if male_share is None:
+            sex_list = MyModel.sex_list if MyModel.sex_list is not None else [0,1]
+            male_share = 0.5 if len(sex_list) > 1 else float(sex_list[0])
+        self.male_share = male_share
+        self.TypeCum = makeCumulativeRows(np.reshape(MyModel.param_dict['TypePrbs'], (1,MyModel.report_type_count)))
+
+        # Rows are sex-age for initial health, sex-age-health for transitions, and type-health for reports
+        self.InitCum = makeCumulativeRows(np.reshape(MyModel.HealthInitDstn, (2*A,N)))
+        if isinstance(MyModel.TransPrbArray, np.ndarray):
+            self.TransCum = makeCumulativeRows(np.reshape(MyModel.TransPrbArray, (2*A*N,N)))
+        else:
+            from scipy.sparse import vstack
+            self.TransCum = makeCumulativeRows(vstack([MyModel.TransPrbArray[s][j] for s in range(2) for j in range(A)], format='csr'))
+        ReportPrbs = np.reshape(np.transpose(MyModel.ReportPrbArray, [0,2,1]), (MyModel.report_type_count*N, MyModel.report_count))
+        self.ReportCums = [makeCumulativeRows(ReportPrbs[:,bot:(bot+C)]) for bot, C in zip(MyModel.measure_starts, MyModel.category_counts)]
+        self.LivPrbArray = np.asarray(MyModel.LivPrbArray, dtype=float)
+
+
+    def simulateChunk(self, resp_count):
+        '''
+        Simulate a chunk of respondents for T_max periods each.
+
+        Parameters
+        ----------
+        resp_count : int
+            Number of respondents to simulate.
+
+        Returns
+        -------
+        chunk : dict
+            Dictionary with arrays of each respondent's sex, age in the first period
+            ('age'), and reporting type (counting from zero), an integer array of
+            shape (resp_count,T_max) with the latent health node in each period
+            ('health', -1 if dead or older than age_max), and an integer array of
+            shape (resp_count,T_max,measure_count) with reports ('reports', counting
+            from one, -1 if not observed).
+        '''
+        MyModel = self.model
+        RNG = self.RNG
+        A = MyModel.age_count_A
+        N = MyModel.x_count_cond
+        T = MyModel.T_max
+
+        sex = (RNG.random(resp_count) < self.male_share).astype(int)
+        j0 = drawFromRows(self.AgeCum, np.zeros(resp_count, dtype=int), RNG)
+        types = drawFromRows(self.TypeCum, np.zeros(resp_count, dtype=int), RNG)
+        health = np.full((T, resp_count), -1, dtype=int) # Period first, so each period's values are contiguous
+        reports = np.full((T, MyModel.measure_count, resp_count), -1, dtype=int)
+
+        alive = np.arange(resp_count)
+        h_now = drawFromRows(self.InitCum, sex*A + j0, RNG)
+        for t in range(T):
+            health[t,alive] = h_now
+            if t % MyModel.wave_length == 0: # Draw reports in survey waves
+                for m in range(MyModel.measure_count):
+                    reports[t,m,alive] = drawFromRows(self.ReportCums[m], types[alive]*N + h_now, RNG) + 1
+
+            # Draw survival to next period, then next period's health for survivors
+            j_now = j0[alive] + t
+            survive = np.logical_and(j_now < A - 1, RNG.random(alive.size) < self.LivPrbArray[sex[alive], np.minimum(j_now, A-1), h_now])
+            alive = alive[survive]
+            if alive.size == 0:
+                break
+            h_now = drawFromRows(self.TransCum, (sex[alive]*A + j_now[survive])*N + h_now[survive], RNG)
+
+        chunk = {
+            'sex' : sex,
+            'age' : MyModel.age_min + j0*MyModel.age_incr,
+            'type' : types,
+            'health' : np.transpose(health),
+            'reports' : np.transpose(reports, [2,0,1]),
+            }
+        return chunk
+
+
+    def simulate(self, output_name, resp_count, chunk_size=100000, truth_name=None):
+        '''
+        Simulate a panel of respondents and write it to disk one chunk at a time,
+        in the layout given by the data settings of the specification.
+
+        Parameters
+        ----------
+        output_name : str
+            The name of the panel data file to write.
+        resp_count : int
+            Number of respondents to simulate.
+        chunk_size : int
+            Number of respondents to simulate and write at once.
+        truth_name : str or None
+            If not None, the name of a file to which to write each respondent's id,
+            reporting type (counting from one), and latent health node in each period.
+
+        Returns
+        -------
+        None
+        '''
+        MyModel = self.model
+        report_cols = MyModel.data_init_col + np.arange(MyModel.T_max*MyModel.measure_count)
+        col_count = report_cols[-1] + 1
+        truth = open(truth_name, 'w') if truth_name is not None else None
+        try:
+            with open(output_name, 'w') as f:
+                for first_id in range(0, resp_count, chunk_size):
+                    chunk = self.simulateChunk(min(chunk_size, resp_count - first_id))
+                    ids = first_id + np.arange(chunk['sex'].size)
+                    panel = np.zeros((ids.size, col_count))
+                    if MyModel.id_col is not None:
+                        panel[:,MyModel.id_col] = ids
+                    panel[:,MyModel.weight_col] = 1.
+                    panel[:,MyModel.sex_col] = chunk['sex']
+                    panel[:,MyModel.age_col] = chunk['age']
+                    panel[:,report_cols] = np.reshape(chunk['reports'], (ids.size, -1))
+                    np.savetxt(f, panel, fmt='%.10g', delimiter='\t')
+                    if truth is not None:
+                        np.savetxt(truth, np.column_stack((ids, chunk['type'] + 1, chunk['health'])), fmt='%d', delimiter='\t')
+                f.close()
+        finally:
+            if truth is not None:
+                truth.close()
+
+
+def main(my_args):
+    '''
+    Simulate a panel from the command line; see documentation at the top of this file.
+
+    Parameters
+    ----------
+    my_args : [str]
+        List of command line arguments, as in sys.argv.
+
+    Returns
+    -------
+    None
+    '''
+    # Process optional arguments for the simulation
+    seed = 0
+    if '--seed' in my_args:
+        i = my_args.index('--seed')
+        seed = int(my_args[i+1])
+        my_args = my_args[:i] + my_args[(i+2):]
+    chunk_size = 100000
+    if '--chunk-size' in my_args:
+        i = my_args.index('--chunk-size')
+        chunk_size = int(my_args[i+1])
+        my_args = my_args[:i] + my_args[(i+2):]
+    truth_name = None
+    if '--truth' in my_args:
+        i = my_args.index('--truth')
+        truth_name = my_args[i+1]
+        my_args = my_args[:i] + my_args[(i+2):]
+
+    # Process optional arguments for building the arrays, as in MakeLatentHealthFile.py
+    dtype = 'float64'
+    if '--dtype' in my_args:
+        i = my_args.index('--dtype')
+        dtype = my_args[i+1]
+        my_args = my_args[:i] + my_args[(i+2):]
+    trans_tol = None
+    if '--trans-tol' in my_args:
+        i = my_args.index('--trans-tol')
+        trans_tol = float(my_args[i+1])
+        my_args = my_args[:i] + my_args[(i+2):]
+    cache = None
+    if '--cache' in my_args:
+        i = my_args.index('--cache')
+        cache = ProbArrayCache(my_args[i+1])
+        my_args = my_args[:i] + my_args[(i+2):]
+
+    # Process required arguments
+    if len(my_args) < 4:
+        print('Please read the documentation at the top of SimulateLatentHealth.py to use this file.')
+        return
+    spec_name = my_args[1]
+    output_name = my_args[2]
+    resp_count = int(my_args[3])
+    node_count = int(my_args[4]) if len(my_args) > 4 else None
+    health_min = float(my_args[5]) if len(my_args) > 5 else None
+    health_max = float(my_args[6]) if len(my_args) > 6 else None
+
+    t0 = time()
+    MyModel = LatentHealthModel(spec_name, node_count, health_min, health_max, trans_tol, dtype)
+    MyModel.build(cache=cache)
+    MySimulator = PanelSimulator(MyModel, seed)
+    MySimulator.simulate(output_name, resp_count, chunk_size, truth_name)
+    t1 = time()
+    print('Simulated ' + str(resp_count) + ' respondents from ' + spec_name + ' and wrote them to ' + output_name + ' in ' + mystr(t1-t0) + ' seconds.')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
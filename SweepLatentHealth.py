@@ -0,0 +1,209 @@
+'''
+This file makes discretized latent health process files for many combinations of
+specification and discretization in a single run, rather than running
+MakeLatentHealthFile.py once for each. It can be run from a command line using:
+
+> python SweepLatentHealth.py output_dir [--specs spec1,spec2] [--grids 40:-6:22,120:-12:28] [--workers N]
+
+output_dir : The directory in which to write the process files and the manifest.
+--specs    : Names of the specification files to use, separated by commas. If this
+             is omitted, every specification in the registry is used.
+--grids    : Discretizations to use, separated by commas, each written as
+             node_count:health_min:health_max. If this is omitted, each specification
+             is discretized as in its own specification file.
+--workers  : Number of processes to use; the default is one.
+
+Each process file is named spec_name_node_count_health_min_health_max.dat. A file
+called manifest.json is also written, listing every file made with its specification,
+discretization, size in bytes, and the time it took to make.
+
+The structural parameters of each specification (from makeParameterDict) do not depend
+on the discretization, so they are made once per specification and shared by all of
+its discretizations.
+'''
+from time import time
+from multiprocessing import Pool
+import json
+import os
+import sys
+from MakeLatentHealthFile import LatentHealthModel, mystr, __version__
+from LatentHealthSpecs import listSpecs
+
+
+def makeSweepTasks(specs, grids):
+    '''
+    Make the list of work to do in a sweep, with the structural parameters of each
+    specification made only once.
+
+    Parameters
+    ----------
+    specs : [str]
+        Names of the specification files to use.
+    grids : [(int, float, float)]
+        Discretizations to use, as (node_count, health_min, health_max). Any of these
+        can be None to use the value in the specification file.
+
+    Returns
+    -------
+    tasks : [tuple]
+        List of (spec_name, node_count, health_min, health_max, param_dict), one for
+        each combination of specification and discretization.
+    '''
+    tasks = []
+    for spec_name in specs:
+        SpecModel = LatentHealthModel(spec_name)
+        param_dict = SpecModel.makeParameterDict(SpecModel.current_param_vec)
+        for node_count, health_min, health_max in grids:
+            tasks.append((spec_name, node_count, health_min, health_max, param_dict))
+    return tasks
+
+
+def runSweepTask(task, output_dir):
+    '''
+    Make one process file in a sweep.
+
+    Parameters
+    ----------
+    task : tuple
+        One element of the list made by makeSweepTasks.
+    output_dir : str
+        The directory in which to write the process file.
+
+    Returns
+    -------
+    entry : dict
+        Description of the process file for the manifest.
+    '''
+    spec_name, node_count, health_min, health_max, param_dict = task
+    t0 = time()
+    MyModel = LatentHealthModel(spec_name, node_count, health_min, health_max)
+    MyModel.build(param_dict=param_dict)
+    file_name = '_'.join([spec_name, str(MyModel.x_count_cond), '{:g}'.format(MyModel.x_min), '{:g}'.format(MyModel.x_max)]) + '.dat'
+    MyModel.write_process(os.path.join(output_dir, file_name))
+    t1 = time()
+
+    entry = {
+        'file' : file_name,
+        'spec_name' : spec_name,
+        'node_count' : int(MyModel.x_count_cond),
+        'health_min' : float(MyModel.x_min),
+        'health_max' : float(MyModel.x_max),
+        'bytes' : os.path.getsize(os.path.join(output_dir, file_name)),
+        'seconds' : t1 - t0,
+        }
+    return entry
+
+
+# Output directory used by each worker process in a parallel sweep
+worker_output_dir = None
+
+def initSweepWorker(output_dir):
+    '''
+    Set up a worker process for a parallel sweep.
+
+    Parameters
+    ----------
+    output_dir : str
+        The directory in which to write the process files.
+
+    Returns
+    -------
+    None
+    '''
+    global worker_output_dir
+    worker_output_dir = output_dir
+
+
+def runSweepWorker(task):
+    '''
+    Make one process file of a sweep in a worker process, writing it to the
+    directory given to initSweepWorker.
+
+    Parameters
+    ----------
+    task : tuple
+        One element of the list made by makeSweepTasks.
+
+    Returns
+    -------
+    entry : dict
+        Description of the process file for the manifest; see runSweepTask.
+    '''
+    return runSweepTask(task, worker_output_dir)
+
+
+def runSweep(specs, grids, output_dir, workers=1):
+    '''
+    Make a process file for every combination of specification and discretization,
+    and write a manifest describing them.
+
+    Parameters
+    ----------
+    specs : [str]
+        Names of the specification files to use.
+    grids : [(int, float, float)]
+        Discretizations to use, as (node_count, health_min, health_max); see makeSweepTasks.
+    output_dir : str
+        The directory in which to write the process files and manifest; it is made
+        if it does not exist.
+    workers : int
+        Number of processes to use.
+
+    Returns
+    -------
+    manifest : dict
+        Dictionary with the code version, total time, and a description of each
+        process file ('files'), as written to manifest.json.
+    '''
+    t0 = time()
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = makeSweepTasks(specs, grids)
+    if workers <= 1:
+        entries = [runSweepTask(task, output_dir) for task in tasks]
+    else:
+        with Pool(workers, initializer=initSweepWorker, initargs=(output_dir,)) as pool:
+            entries = pool.map(runSweepWorker, tasks, chunksize=1)
+    t1 = time()
+
+    manifest = {'version' : __version__, 'seconds' : t1 - t0, 'files' : entries}
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main(my_args):
+    '''
+    Run a sweep from the command line; see documentation at the top of this file.
+
+    Parameters
+    ----------
+    my_args : [str]
+        List of command line arguments, as in sys.argv.
+
+    Returns
+    -------
+    None
+    '''
+    if len(my_args) < 2:
+        print('Please read the documentation at the top of SweepLatentHealth.py to use this file.')
+        return
+    output_dir = my_args[1]
+
+    # Process optional arguments
+    specs = listSpecs()
+    if '--specs' in my_args:
+        specs = my_args[my_args.index('--specs')+1].split(',')
+    grids = [(None, None, None)]
+    if '--grids' in my_args:
+        grids = []
+        for grid in my_args[my_args.index('--grids')+1].split(','):
+            node_count, health_min, health_max = grid.split(':')
+            grids.append((int(node_count), float(health_min), float(health_max)))
+    workers = int(my_args[my_args.index('--workers')+1]) if '--workers' in my_args else 1
+
+    manifest = runSweep(specs, grids, output_dir, workers)
+    print('Wrote ' + str(len(manifest['files'])) + ' discretized latent health processes to ' + output_dir + ' in ' + mystr(manifest['seconds']) + ' seconds.')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
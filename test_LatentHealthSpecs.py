@@ -0,0 +1,49 @@
+'''
+Tests of the specification registry in LatentHealthSpecs.py. Each test makes a
+registry in a temporary directory from a copy of one specification file, so the
+registry in ParameterSpecs is never changed.
+'''
+import os
+import shutil
+import pytest
+import LatentHealthSpecs
+
+# Specification that is copied into the temporary directory
+test_spec_source = 'TwoStudyAllOver23HeteroParams'
+
+# Name of the copy, which must not match a module that may already be imported
+test_spec_name = 'RegistryTestParams'
+
+
+@pytest.fixture
+def temp_registry(tmp_path, monkeypatch):
+    '''
+    Make a registry of one copied specification in tmp_path and point
+    LatentHealthSpecs at it.
+    '''
+    spec_file = os.path.join(str(tmp_path), test_spec_name + '.py')
+    shutil.copy(os.path.join(LatentHealthSpecs.spec_dir, test_spec_source + '.py'), spec_file)
+    registry_file = os.path.join(str(tmp_path), 'SpecRegistry.json')
+    monkeypatch.setattr(LatentHealthSpecs, 'spec_dir', str(tmp_path))
+    monkeypatch.setattr(LatentHealthSpecs, 'spec_registry_file', registry_file)
+    monkeypatch.setattr(LatentHealthSpecs, 'spec_registry', None)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    LatentHealthSpecs.makeSpecRegistry(registry_file)
+    return spec_file
+
+
+def test_registry_matches_spec_files():
+    for name in LatentHealthSpecs.listSpecs():
+        LatentHealthSpecs.getSpec(name)
+
+
+def test_unchanged_spec_loads(temp_registry):
+    spec = LatentHealthSpecs.getSpec(test_spec_name)
+    assert spec['source_hash'] == LatentHealthSpecs.hashSpecFile(test_spec_name)
+
+
+def test_changed_spec_raises(temp_registry):
+    with open(temp_registry, 'a') as f:
+        f.write('\ncurrent_param_vec = current_param_vec + 1.0\n')
+    with pytest.raises(ValueError, match='has changed since the registry was made'):
+        LatentHealthSpecs.getSpec(test_spec_name)